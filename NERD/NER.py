@@ -10,9 +10,13 @@ from nltk import word_tokenize, pos_tag
 import random
 import pickle
 import os
+import time
+import threading
+import sys
 from bs4 import BeautifulSoup
 from bs4 import Tag
 from collections import Counter
+import itertools
 
 from flask import Flask
 from flask import request
@@ -20,6 +24,15 @@ from jinja2 import Template
 import pandas as pd
 from nltk import download as nltk_download
 
+from NERD.archive import ARCHIVE_EXTENSION, ColumnArchive
+from NERD.cache import LRUCache
+from NERD.crf import prune_crf
+from NERD.dedup import NearDuplicateIndex
+from NERD.gazetteer import GazetteerMatcher
+from NERD.parallel import run_tasks, stream_tasks
+from NERD.sampling import ClusterSampler
+from NERD.selection import select_diverse
+
 nltk_download('punkt')
 nltk_download('averaged_perceptron_tagger')
 
@@ -29,22 +42,96 @@ class BaseNerTagger:
     A utility class for NER Tagging.
     """
 
-    def __init__(self, unlabelled, labelled=None, data_directory=''):
+    def __init__(self, unlabelled, labelled=None, data_directory='', incremental=False, incremental_iterations=20,
+                 replay_size=100, full_refit_every=5, query_batch_size=10, query_diversity=0.5,
+                 feature_cache_entries=10000, feature_cache_bytes=None, gazetteers=None, gazetteer_preference=0.8,
+                 dedup=False, dedup_threshold=0.8, propagate_labels=False, compact_min_weight=0.2,
+                 cold_start='random', n_clusters=50):
         """
         Initialize with a list of unlabelled strings and/or list of tagged tuples.
         Args:
             unlabelled: list of strings
             labelled: list of {list of tuples [(token, pos_tag, tag), ...]}
             data_directory: Default directory to save all data
+            incremental: If True, model updates train on the newly labelled examples plus a replay sample
+                of older ones with a bounded iteration budget, instead of refitting on everything.
+            incremental_iterations: L-BFGS iteration budget of an incremental update
+            replay_size: number of previously labelled examples mixed into an incremental update
+            full_refit_every: in incremental mode, every n-th update is a full refit
+            query_batch_size: number of examples selected per active learning scoring pass
+            query_diversity: weight of the redundancy penalty used when selecting a batch
+            feature_cache_entries: maximum number of unlabelled examples whose features are cached
+            feature_cache_bytes: maximum estimated memory of the cached unlabelled features
+            gazetteers: dict of tag -> list of known entity strings. Before the first model update, examples are
+                pre-tagged with the gazetteer matches and examples with matches are preferred.
+            gazetteer_preference: probability of picking a random example among the ones with gazetteer matches
+            dedup: collapse near duplicate unlabelled texts (MinHash/LSH over token shingles). Only the first text
+                of a group is tagged, scored and shown.
+            dedup_threshold: minimum estimated shingle Jaccard similarity of near duplicates
+            propagate_labels: when a group representative is labelled, its duplicates with the same tokens are
+                labelled with the same tags. Duplicates of already labelled examples are dropped.
+            compact_min_weight: state features with an absolute weight below this are dropped from the compact
+                model used for scoring and find_entities_in_text (see get_compact_model). 0 keeps every feature.
+            cold_start: how get_new_random_example picks examples
+                - random (Default): uniformly at random
+                - cluster: representative examples spread over n_clusters clusters of the pool (see
+                  ClusterSampler). The clusters also penalize same-cluster examples in batch queries.
+            n_clusters: number of clusters of the cluster cold start
         """
+        if cold_start not in ('random', 'cluster'):
+            raise ValueError(f'Unknown cold start {cold_start}')
+        self.cluster_sampler = ClusterSampler(n_clusters=n_clusters) if cold_start == 'cluster' else None
+        self._next_example_id = 0
+        self.dedup_index = NearDuplicateIndex(threshold=dedup_threshold) if dedup else None
+        self.propagate_labels = propagate_labels
+        # representative example id -> texts of its duplicates, kept for label propagation
+        self.duplicate_texts = {}
+        # ids of the labelled representatives, whose later duplicates are dropped
+        self._propagated_ids = set()
+        self.n_propagated = 0
+        # one dict of statistics per batch of unlabelled texts added
+        self.ingestion_history = []
+        # archive path -> ids of the examples already saved to it
+        self._archived_ids = {}
+        self.gazetteer = None
+        if gazetteers is not None:
+            self.gazetteer = GazetteerMatcher(gazetteers, tokenizer=word_tokenize)
+        self.gazetteer_preference = gazetteer_preference
+        # unlabelled examples with gazetteer matches
+        self.gazetteer_examples = []
+        # example id -> position in self.unlabelled
+        self._unlabelled_positions = {}
         if unlabelled is None:
             self.unlabelled = None
         else:
-            self.unlabelled = [{'raw': BaseNerTagger._get_pos_tagged_example(text)} for text in unlabelled]
+            self.unlabelled = self._make_unlabelled_examples(unlabelled)
+            self._index_unlabelled()
         if labelled is None:
             labelled = []
         self.labelled = labelled
         self.model = None
+        self.compact_min_weight = compact_min_weight
+        # (model, compact copy of the model)
+        self._compact_model = None
+        self.crf_params = dict(DEFAULT_CRF_PARAMS)
+        # features of unlabelled examples, keyed by example id. Labelled examples keep theirs in 'features'.
+        self.feature_cache = LRUCache(max_entries=feature_cache_entries, max_bytes=feature_cache_bytes,
+                                      sizeof=BaseNerTagger._features_sizeof)
+        # optional shared executor used for model fitting and cross validation / tuning
+        self.executor = None
+
+        self.incremental = incremental
+        self.incremental_iterations = incremental_iterations
+        self.replay_size = replay_size
+        self.full_refit_every = full_refit_every
+        self.training_history = []
+        self.query_batch_size = query_batch_size
+        self.query_diversity = query_diversity
+        # examples selected by the last batch query, not yet shown
+        self.example_queue = []
+        self._n_updates = 0
+        # number of labelled examples the current model has seen
+        self._n_fitted = 0
 
         self.data_directory = os.path.join(data_directory, 'NER_Data')
         os.makedirs(self.data_directory, exist_ok=True)
@@ -56,6 +143,67 @@ class BaseNerTagger:
         toret = pos_tag(tokens)
         return toret
 
+    def _make_unlabelled_examples(self, texts):
+        start = time.perf_counter()
+        examples = []
+        n_texts = 0
+        for text in texts:
+            n_texts += 1
+            if self.dedup_index is not None:
+                representative = self.dedup_index.add(self._next_example_id, text)
+                if representative is not None:
+                    if self.propagate_labels and representative not in self._propagated_ids:
+                        self.duplicate_texts.setdefault(representative, []).append(text)
+                    continue
+            example = {'id': self._next_example_id, 'raw': BaseNerTagger._get_pos_tagged_example(text)}
+            self._next_example_id += 1
+            if self.gazetteer is not None:
+                pretags = self.gazetteer.tag([tok[0] for tok in example['raw']])
+                if any(tag != 'O' for tag in pretags):
+                    example['pretags'] = pretags
+                    self.gazetteer_examples.append(example)
+            examples.append(example)
+        if self.cluster_sampler is not None:
+            self.cluster_sampler.add([example['id'] for example in examples],
+                                     [' '.join(tok[0] for tok in example['raw']) for example in examples])
+        elapsed = time.perf_counter() - start
+        self.ingestion_history.append({
+            'texts': n_texts,
+            'added': len(examples),
+            'duplicates': n_texts - len(examples),
+            'seconds': elapsed,
+            'texts_per_second': n_texts / elapsed if elapsed > 0 else 0.0,
+        })
+        return examples
+
+    @staticmethod
+    def _features_sizeof(features):
+        """
+        Rough estimate of the memory taken by the features of a sentence. The feature names are shared
+        between tokens and are not counted.
+        """
+        size = sys.getsizeof(features)
+        for token_features in features:
+            size += sys.getsizeof(token_features)
+            for value in token_features.values():
+                size += sys.getsizeof(value)
+        return size
+
+    def _get_features(self, example):
+        """
+        Returns the features of an example. Features of unlabelled examples are kept in the bounded
+        feature cache instead of the example itself.
+        """
+        if 'features' in example:
+            return example['features']
+        key = example.get('id')
+        features = self.feature_cache.get(key)
+        if features is None:
+            features = BaseNerTagger._sent2features(example['raw'])
+            if key is not None:
+                self.feature_cache.put(key, features)
+        return features
+
     @staticmethod
     def _is_alpha_and_numeric(string):
         """
@@ -211,13 +359,44 @@ class BaseNerTagger:
     def get_new_random_example(self):
         """
         Returns a random example to be tagged. Used to bootstrap the model.
+        With gazetteers, examples with gazetteer matches are preferred and returned pre-tagged.
+        With the cluster cold start, examples are representatives of the clusters of the pool.
         Returns: Randomly selected text
 
         """
-        self.current_example_index = random.randint(0, len(self.unlabelled) - 1)
-        self.current_example = self.unlabelled[self.current_example_index]
+        example = None
+        if len(self.gazetteer_examples) > 0 and random.random() < self.gazetteer_preference:
+            example = self._pop_random_gazetteer_example()
+        if example is None and self.cluster_sampler is not None:
+            example = self._pop_cluster_example()
+        if example is not None:
+            self.current_example_index = self._unlabelled_positions.get(example['id'])
+            self.current_example = example
+        else:
+            self.current_example_index = random.randint(0, len(self.unlabelled) - 1)
+            self.current_example = self.unlabelled[self.current_example_index]
+        if 'pretags' in self.current_example:
+            return BaseNerTagger._add_prediction_to_postagged_data(self.current_example['raw'],
+                                                                   self.current_example['pretags'])
         return self.current_example['raw']
 
+    def _pop_random_gazetteer_example(self):
+        while len(self.gazetteer_examples) > 0:
+            i = random.randint(0, len(self.gazetteer_examples) - 1)
+            example = self.gazetteer_examples[i]
+            self.gazetteer_examples[i] = self.gazetteer_examples[-1]
+            self.gazetteer_examples.pop()
+            # labelled examples lose their pretags
+            if 'pretags' in example:
+                return example
+        return None
+
+    def _pop_cluster_example(self):
+        key = self.cluster_sampler.sample()
+        if key is None:
+            return None
+        return self.get_unlabelled_example(key)
+
     def get_new_random_predicted_example(self):
         """
         Returns a random example tagged by the currently tagged model.
@@ -226,11 +405,31 @@ class BaseNerTagger:
         """
         self.current_example_index = random.randint(0, len(self.unlabelled) - 1)
         self.current_example = self.unlabelled[self.current_example_index]
-        raw = self.current_example['raw']
-        features = BaseNerTagger._sent2features(raw)
-        preds = self.model.predict_single(features)
-        toret = BaseNerTagger._add_prediction_to_postagged_data(raw, preds)
-        return toret
+        return self._predict_example(self.current_example)
+
+    def _score_unlabelled_sample(self, mode='max', sample_size=250):
+        """
+        Scores a random sample of the unlabelled examples with the current model.
+        Args:
+            mode: uncertainty aggregation (max/mean)
+            sample_size: number of unlabelled examples to score
+
+        Returns: (sampled indices, uncertainties)
+
+        """
+        if len(self.unlabelled) == 1:
+            sample = [0]
+        else:
+            sample = np.random.randint(0, len(self.unlabelled) - 1, size=sample_size).tolist()
+        X = [self._get_features(self.unlabelled[s]) for s in sample]
+        preds = self.get_compact_model().predict_marginals(X)
+        uncertainities = [BaseNerTagger._get_prediction_uncertainity(pred, mode) for pred in preds]
+        return sample, uncertainities
+
+    def _predict_example(self, example):
+        raw = example['raw']
+        preds = self.model.predict_single(self._get_features(example))
+        return BaseNerTagger._add_prediction_to_postagged_data(raw, preds)
 
     def query_new_example(self, mode='max'):
         """
@@ -243,95 +442,496 @@ class BaseNerTagger:
         Returns:
 
         """
-        if len(self.unlabelled) == 1:
-            sample = [0]
-        else:
-            sample = np.random.randint(0, len(self.unlabelled) - 1, size=250).tolist()
-        X = []
-        for s in sample:
-            example = self.unlabelled[s]
-            if 'features' not in example:
-                example['features'] = BaseNerTagger._sent2features(example['raw'])
-            X.append(example['features'])
-        preds = self.model.predict_marginals(X)
-        uncertainities = [BaseNerTagger._get_prediction_uncertainity(pred, mode) for pred in preds]
+        sample, uncertainities = self._score_unlabelled_sample(mode)
         index = np.argmax(uncertainities)
         self.current_example_index = sample[index]
         self.current_example = self.unlabelled[self.current_example_index]
-        raw = self.current_example['raw']
-        features = self.current_example['features']
-        preds = self.model.predict_single(features)
-        toret = BaseNerTagger._add_prediction_to_postagged_data(raw, preds)
-        return toret
+        return self._predict_example(self.current_example)
+
+    def query_new_examples(self, size=10, mode='max', diversity=None, sample_size=250):
+        """
+        Selects a batch of examples from a single scoring pass. The most uncertain examples are
+        picked greedily, penalizing token overlap with the examples already in the batch.
+        The batch is queued and served one by one by get_next_queued_example.
+        Args:
+            size: number of examples in the batch
+            mode: Active Learning Strategy (max/mean)
+            diversity: weight of the redundancy penalty in [0, 1]. Defaults to query_diversity.
+            sample_size: number of unlabelled examples to score
+
+        Returns: list of examples tagged by the current model
+
+        """
+        if diversity is None:
+            diversity = self.query_diversity
+        sample, uncertainities = self._score_unlabelled_sample(mode, max(sample_size, size))
+        # the random sample may contain repeated indices
+        unique = {}
+        for s, u in zip(sample, uncertainities):
+            unique[s] = u
+        sample = list(unique.keys())
+        token_sets = [set(tok[0].lower() for tok in self.unlabelled[s]['raw']) for s in sample]
+        clusters = None
+        if self.cluster_sampler is not None:
+            clusters = [self.cluster_sampler.cluster_of(self.unlabelled[s].get('id')) for s in sample]
+        selected = select_diverse(list(unique.values()), token_sets, size, diversity, clusters=clusters)
+        self.example_queue = [self.unlabelled[sample[i]] for i in selected]
+        return [self._predict_example(example) for example in self.example_queue]
+
+    def get_next_queued_example(self, mode='max'):
+        """
+        Returns the next example of the current batch, tagged by the current model. A new batch of
+        query_batch_size examples is queried when the batch is used up.
+        Args:
+            mode: Active Learning Strategy (max/mean)
+
+        Returns: list of tuples [(token, pos_tag, predicted tag), ...]
+
+        """
+        if len(self.example_queue) == 0:
+            self.query_new_examples(size=self.query_batch_size, mode=mode)
+        self.current_example = self.example_queue.pop(0)
+        # resolved lazily in save_example
+        self.current_example_index = None
+        return self._predict_example(self.current_example)
+
+    def _index_unlabelled(self, start=0):
+        for index in range(start, len(self.unlabelled)):
+            self._unlabelled_positions[self.unlabelled[index]['id']] = index
+
+    def _find_unlabelled_index(self, example, hint=None):
+        if hint is not None and hint < len(self.unlabelled) and self.unlabelled[hint] is example:
+            return hint
+        index = self._unlabelled_positions.get(example.get('id'))
+        if index is not None and self.unlabelled[index] is example:
+            return index
+        return None
+
+    def _remove_unlabelled(self, index):
+        # the last example takes the freed position, so the removal is O(1)
+        example = self.unlabelled[index]
+        last = self.unlabelled.pop()
+        if index < len(self.unlabelled):
+            self.unlabelled[index] = last
+            self._unlabelled_positions[last['id']] = index
+        del self._unlabelled_positions[example['id']]
+
+    def get_unlabelled_example(self, example_id):
+        """
+        Args:
+            example_id: id of an unlabelled example
+
+        Returns: the example, or None if there is no unlabelled example with this id
+
+        """
+        index = self._unlabelled_positions.get(example_id)
+        return self.unlabelled[index] if index is not None else None
+
+    @staticmethod
+    def _build_crf(params):
+        return CRF(
+            algorithm='lbfgs',
+            c1=params['c1'],
+            c2=params['c2'],
+            max_iterations=params['max_iterations'],
+            all_possible_transitions=True
+        )
+
+    @staticmethod
+    def _get_entity_spans(tags):
+        """
+        Extracts entity spans from a sequence of BILOU tags
+        Args:
+            tags: list of BILOU tags
+
+        Returns: set of (start, end, entity) tuples, end exclusive
+
+        """
+        spans = set()
+        start = None
+        curr_ent = None
+        for i, tag in enumerate(tags):
+            prefix, ent = tag[:1], tag[2:]
+            if prefix == 'U':
+                spans.add((i, i + 1, ent))
+                start = None
+            elif prefix == 'B':
+                start, curr_ent = i, ent
+            elif prefix == 'I':
+                if ent != curr_ent:
+                    start = None
+            elif prefix == 'L':
+                if start is not None and ent == curr_ent:
+                    spans.add((start, i + 1, ent))
+                start = None
+            else:
+                start = None
+        return spans
+
+    def _get_folds(self, k, seed):
+        indices = list(range(len(self.labelled)))
+        random.Random(seed).shuffle(indices)
+        return [indices[i::k] for i in range(k)]
+
+    @staticmethod
+    def _get_token_accuracy(model, examples):
+        """
+        Token level accuracy of the model on labelled examples
+        Args:
+            model: trained CRF model
+            examples: list of labelled examples
+
+        Returns: accuracy or None if there are no tokens
+
+        """
+        correct = 0
+        total = 0
+        for item in examples:
+            preds = model.predict_single(item['features'])
+            labels = BaseNerTagger._sent2labels(item['raw'])
+            correct += sum(1 for p, l in zip(preds, labels) if p == l)
+            total += len(labels)
+        if total == 0:
+            return None
+        return correct / total
 
     def update_model(self):
         """
-        Updates the model with the currently labelled dataset
-        Returns:
+        Updates the model with the currently labelled dataset.
+
+        In incremental mode only the examples labelled since the last update, plus a random replay sample of
+        older examples, are used with a bounded iteration budget. Every `full_refit_every` updates a full refit
+        is done. Before training, the previous model is scored on the newly labelled examples (which it has
+        not seen), so `training_history` records the time/accuracy trade-off of each update.
+        With a shared executor the CRF is trained in one of its workers.
+        Returns: dict with the statistics of this update
+
+        """
+        new_examples = self.labelled[self._n_fitted:]
+        holdout_accuracy = None
+        if self.model is not None and len(new_examples) > 0:
+            holdout_accuracy = BaseNerTagger._get_token_accuracy(self.model, new_examples)
+
+        full_refit = (not self.incremental or self.model is None or self._n_fitted == 0
+                      or self._n_updates % self.full_refit_every == 0)
+        if full_refit:
+            train = self.labelled
+            max_iterations = self.crf_params['max_iterations']
+        else:
+            old_examples = self.labelled[:self._n_fitted]
+            train = random.sample(old_examples, min(self.replay_size, len(old_examples))) + new_examples
+            max_iterations = self.incremental_iterations
+
+        model = BaseNerTagger._build_crf(dict(self.crf_params, max_iterations=max_iterations))
+        X = [item['features'] for item in train]
+        Y = [BaseNerTagger._sent2labels(item['raw']) for item in train]
+        start = time.perf_counter()
+        model = run_tasks(_fit_crf, [(model, X, Y)], n_jobs=1, executor=self.executor)[0]
+        elapsed = time.perf_counter() - start
+
+        self.model = model
+        # queued examples were selected by the previous model
+        self.example_queue = []
+        self._n_fitted = len(self.labelled)
+        self._n_updates += 1
+        stats = {
+            'mode': 'full' if full_refit else 'incremental',
+            'labelled': len(self.labelled),
+            'trained_on': len(train),
+            'max_iterations': max_iterations,
+            'train_seconds': elapsed,
+            'holdout_examples': len(new_examples),
+            'holdout_accuracy': holdout_accuracy,
+        }
+        self.training_history.append(stats)
+        return stats
+
+    def get_compact_model(self):
+        """
+        Copy of the current model without its state features below compact_min_weight, built on first use
+        after every update. It is a crfsuite model too, only smaller and faster to decode.
+        Returns: sklearn_crfsuite.CRF or None if there is no model yet
 
         """
         if self.model is None:
-            self.model = CRF(
-                algorithm='lbfgs',
-                c1=0.1,
-                c2=0.1,
-                max_iterations=100,
-                all_possible_transitions=True
-            )
+            return None
+        if self._compact_model is None or self._compact_model[0] is not self.model:
+            self._compact_model = (self.model, prune_crf(self.model, self.compact_min_weight))
+        return self._compact_model[1]
+
+    def compact_model_stats(self, examples=None):
+        """
+        Compares the current model with its compact copy
+        Args:
+            examples: labelled examples to time and score both models on (defaults to all labelled examples)
+
+        Returns: dict with, for the 'crf' and 'compact' models, the number of state features, pickled bytes,
+            prediction seconds and token accuracy, plus the fraction of tokens on which both models agree
+
+        """
+        if examples is None:
+            examples = self.labelled
+        compact = self.get_compact_model()
+        X = [item['features'] for item in examples]
+        stats = {}
+        predictions = {}
+        for name, model in [('crf', self.model), ('compact', compact)]:
+            start = time.perf_counter()
+            predictions[name] = [model.predict_single(xseq) for xseq in X]
+            elapsed = time.perf_counter() - start
+            stats[name] = {
+                'state_features': len(model.state_features_),
+                'bytes': len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)),
+                'predict_seconds': elapsed,
+                'accuracy': BaseNerTagger._get_token_accuracy(model, examples),
+            }
+        pairs = [(a, b) for s1, s2 in zip(predictions['crf'], predictions['compact']) for a, b in zip(s1, s2)]
+        stats['agreement'] = sum(1 for a, b in pairs if a == b) / len(pairs) if pairs else None
+        return stats
+
+    def _cross_validate(self, param_sets, k, n_jobs, seed):
+        """
+        Runs k-fold cross validation of every parameter set over a process pool (the shared executor if set).
+        The labelled features and labels are sent to each worker once, a task only carries its parameters and
+        fold number.
+        Returns: list of fold results, the k folds of the first parameter set first
+
+        """
+        if k < 2 or k > len(self.labelled):
+            raise ValueError(f'Cannot run {k}-fold cross validation on {len(self.labelled)} labelled examples')
         X = [item['features'] for item in self.labelled]
         Y = [BaseNerTagger._sent2labels(item['raw']) for item in self.labelled]
-        self.model.fit(X, Y)
+        tasks = ((params, fold) for params in param_sets for fold in range(k))
+        try:
+            return list(stream_tasks(_cross_validate_fold_in_worker, tasks, n_jobs=n_jobs,
+                                     initializer=_init_cross_validation_worker,
+                                     initargs=(X, Y, self._get_folds(k, seed)), executor=self.executor))
+        finally:
+            # with n_jobs=1 the data was installed in this process
+            _cross_validation_worker_state.clear()
+
+    def evaluate(self, params=None, k=5, n_jobs=None, seed=0):
+        """
+        Measures model quality with k-fold cross validation on the labelled dataset.
+        The folds are trained in parallel over a process pool.
+        Args:
+            params: CRF parameters (c1, c2, max_iterations). Defaults to the current parameters.
+            k: number of folds
+            n_jobs: number of worker processes (None uses all cores)
+            seed: seed for shuffling the examples into folds
+
+        Returns: dict with per entity and micro averaged precision/recall/f1 and the wall time
+
+        """
+        params = dict(self.crf_params, **(params or {}))
+        start = time.perf_counter()
+        fold_results = self._cross_validate([params], k, n_jobs, seed)
+        result = _summarize_fold_results(params, fold_results)
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    def tune(self, param_grid=None, n_iter=None, k=3, n_jobs=None, adopt=True, seed=0):
+        """
+        Grid or random search over the CRF regularization parameters using k-fold cross validation.
+        All (configuration, fold) pairs are trained in parallel over a process pool.
+        Args:
+            param_grid: dict of parameter name -> list of values. Defaults to DEFAULT_CRF_PARAM_GRID.
+            n_iter: if given, evaluate only n_iter randomly sampled configurations from the grid
+            k: number of folds
+            n_jobs: number of worker processes (None uses all cores)
+            adopt: use the best configuration for later model updates
+            seed: seed for the fold split and the random search
+
+        Returns: list of evaluation results (see evaluate), best configuration first
 
-    def save_example(self, data):
         """
-        Saves the current example with the user tagged data
+        if param_grid is None:
+            param_grid = DEFAULT_CRF_PARAM_GRID
+        names = list(param_grid.keys())
+        param_sets = [dict(self.crf_params, **dict(zip(names, values)))
+                      for values in itertools.product(*[param_grid[n] for n in names])]
+        if n_iter is not None and n_iter < len(param_sets):
+            param_sets = random.Random(seed).sample(param_sets, n_iter)
+
+        start = time.perf_counter()
+        fold_results = self._cross_validate(param_sets, k, n_jobs, seed)
+        elapsed = time.perf_counter() - start
+
+        results = []
+        for i, params in enumerate(param_sets):
+            result = _summarize_fold_results(params, fold_results[i * k:(i + 1) * k])
+            result['seconds'] = sum(r['seconds'] for r in fold_results[i * k:(i + 1) * k])
+            results.append(result)
+        results.sort(key=lambda r: r['micro']['f1'], reverse=True)
+        for result in results:
+            result['search_seconds'] = elapsed
+        if adopt and len(results) > 0:
+            self.crf_params = dict(results[0]['params'])
+        return results
+
+    def save_example(self, data, example_id=None):
+        """
+        Saves the current example, or the unlabelled example example_id, with the user tagged data
         Args:
             data: User tagged data. [list of tags]
+            example_id: id of the example (e.g. a /load_batch item). Defaults to the current example.
 
-        Returns:
+        Returns: True if the example was saved, False if the example is unknown, already labelled or has
+            a different number of tokens
 
         """
-        if len(data) != len(self.current_example['raw']):
+        if example_id is None:
+            example = self.current_example
+            # indices shift as examples get labelled, locate the example again if needed
+            index = self._find_unlabelled_index(example, self.current_example_index)
+        else:
+            index = self._unlabelled_positions.get(example_id)
+            example = self.unlabelled[index] if index is not None else None
+        if example is None or len(data) != len(example['raw']):
             return False
         else:
             toret = []
-            for index in range(len(data)):
-                toret.append(
-                    (self.current_example['raw'][index][0], self.current_example['raw'][index][1], data[index][1]))
+            for index_ in range(len(data)):
+                toret.append((example['raw'][index_][0], example['raw'][index_][1], data[index_][1]))
 
-            example = self.current_example
             example['raw'] = toret
             example['features'] = BaseNerTagger._sent2features(toret)
+            example.pop('pretags', None)
+            self.feature_cache.pop(example.get('id'))
+            if self.cluster_sampler is not None:
+                self.cluster_sampler.discard(example.get('id'))
             self.labelled.append(example)
-            self.unlabelled.pop(self.current_example_index)
+            if index is not None:
+                self._remove_unlabelled(index)
+            self.example_queue = [item for item in self.example_queue if item is not example]
+            if self.propagate_labels:
+                self._propagate_label(example)
+            return True
+
+    def _propagate_label(self, example):
+        """
+        Labels the near duplicates of a newly labelled example which have exactly the same tokens
+        Args:
+            example: labelled example
+
+        Returns:
+
+        """
+        tokens = [tok[0] for tok in example['raw']]
+        self._propagated_ids.add(example.get('id'))
+        for text in self.duplicate_texts.pop(example.get('id'), []):
+            tagged = BaseNerTagger._get_pos_tagged_example(text)
+            if [tok[0] for tok in tagged] != tokens:
+                continue
+            raw = [(tok[0], tok[1], labelled_tok[2]) for tok, labelled_tok in zip(tagged, example['raw'])]
+            self.labelled.append({'id': self._next_example_id, 'raw': raw,
+                                  'features': BaseNerTagger._sent2features(raw)})
+            self._next_example_id += 1
+            self.n_propagated += 1
+
+    def dedup_stats(self):
+        """
+        Near duplicate collapsing statistics
+        Returns: dict with the texts seen, representatives, duplicates, shrinkage of the pool, dedup throughput,
+            pool size and number of propagated labels
+
+        """
+        stats = self.dedup_index.stats() if self.dedup_index is not None else {}
+        stats['pool'] = len(self.unlabelled) if self.unlabelled is not None else 0
+        stats['propagated'] = self.n_propagated
+        return stats
+
+    def cluster_stats(self):
+        """
+        Cluster cold start statistics
+        Returns: dict with the clusters, indexed and available examples, cluster sizes, number of clusters
+            sampled from and clustering time (empty without the cluster cold start)
+
+        """
+        return self.cluster_sampler.stats() if self.cluster_sampler is not None else {}
 
     def save_data(self, filepath=None):
         """
         Saves the labelled data to a file
         Args:
-            filepath: file to save the data in a pickle format.
+            filepath: file to save the data in a pickle format, or a compressed columnar archive if it ends
+                with .nerd. Examples not saved to the archive yet are appended to it as a new chunk of
+                token/POS/tag arrays and per example ids and lengths.
 
         Returns:
 
         """
         if filepath is None:
             filepath = os.path.join(self.data_directory, 'ner_tagged_data.pickle')
+        if filepath.endswith(ARCHIVE_EXTENSION):
+            self._append_to_archive(filepath)
+            return
         with open(filepath, 'wb') as out:
             pickle.dump(self.labelled, out)
 
+    def _append_to_archive(self, filepath):
+        path = os.path.abspath(filepath)
+        if not os.path.exists(path):
+            self._archived_ids[path] = set()
+        archived = self._archived_ids.setdefault(path, set())
+        examples = []
+        for example in self.labelled:
+            if example.get('id') is None:
+                example['id'] = self._next_example_id
+                self._next_example_id += 1
+            if example['id'] not in archived:
+                examples.append(example)
+        if len(examples) == 0:
+            return
+        tokens = [tok for example in examples for tok in example['raw']]
+        ColumnArchive(path).append({
+            'id': np.array([example['id'] for example in examples], dtype=np.int64),
+            'length': np.array([len(example['raw']) for example in examples], dtype=np.int32),
+            'token': [tok[0] for tok in tokens],
+            'pos': [tok[1] for tok in tokens],
+            'tag': [tok[2] for tok in tokens],
+        })
+        archived.update(example['id'] for example in examples)
+
+    def _load_archive(self, filepath):
+        """
+        Args:
+            filepath: archive saved by save_data
+
+        Returns: list of labelled examples, without features
+
+        """
+        data = ColumnArchive(filepath).read(['id', 'length', 'token', 'pos', 'tag'])
+        raw = list(zip(data['token'].tolist(), data['pos'].tolist(), data['tag'].tolist()))
+        ends = np.cumsum(data['length']).tolist()
+        examples = []
+        start = 0
+        for example_id, end in zip(data['id'].tolist(), ends):
+            examples.append({'id': example_id, 'raw': raw[start:end]})
+            start = end
+        if len(examples) > 0:
+            self._next_example_id = max(self._next_example_id, max(data['id'].tolist()) + 1)
+        self._archived_ids[os.path.abspath(filepath)] = set(data['id'].tolist())
+        return examples
+
     def load_data(self, filepath=None):
         """
         Loads labelled data from file.
         Args:
-            filepath: file containing pickeled labelled dataset
+            filepath: file containing pickeled labelled dataset, or an archive (.nerd) saved by save_data
 
         Returns:
 
         """
-        with open(filepath, 'rb') as inp:
-            self.labelled = pickle.load(inp)
-            for lab in self.labelled:
-                lab['features'] = BaseNerTagger._sent2features(lab['raw'])
+        if filepath.endswith(ARCHIVE_EXTENSION):
+            self.labelled = self._load_archive(filepath)
+        else:
+            with open(filepath, 'rb') as inp:
+                self.labelled = pickle.load(inp)
+        for lab in self.labelled:
+            lab['features'] = BaseNerTagger._sent2features(lab['raw'])
+        # the labelled set was replaced, the next update has to be a full refit
+        self._n_fitted = 0
 
     def add_unlabelled_examples(self, examples):
         """
@@ -342,8 +942,99 @@ class BaseNerTagger:
         Returns:
 
         """
-        new_examples = [{'raw': BaseNerTagger._get_pos_tagged_example(text)} for text in examples]
+        new_examples = self._make_unlabelled_examples(examples)
+        if self.unlabelled is None:
+            self.unlabelled = []
+        start = len(self.unlabelled)
         self.unlabelled.extend(new_examples)
+        self._index_unlabelled(start)
+
+
+DEFAULT_CRF_PARAMS = {
+    'c1': 0.1,
+    'c2': 0.1,
+    'max_iterations': 100,
+}
+
+DEFAULT_CRF_PARAM_GRID = {
+    'c1': [0.0, 0.05, 0.1, 0.5, 1.0],
+    'c2': [0.001, 0.01, 0.1, 0.5, 1.0],
+}
+
+
+def _fit_crf(model, X, Y):
+    """
+    Trains a CRF, e.g. in a worker of a shared pool
+    Returns: the trained CRF
+
+    """
+    model.fit(X, Y)
+    return model
+
+
+def _cross_validate_crf_fold(params, train_X, train_Y, test_X, test_Y):
+    """
+    Trains a CRF on one cross validation fold and counts entity level matches on the held out part.
+    Returns: dict with the per entity counts {entity: [true positives, false positives, false negatives]}
+    and the time taken
+
+    """
+    start = time.perf_counter()
+    model = BaseNerTagger._build_crf(params)
+    model.fit(train_X, train_Y)
+    preds = model.predict(test_X)
+    counts = {}
+    for pred, gold in zip(preds, test_Y):
+        pred_spans = BaseNerTagger._get_entity_spans(pred)
+        gold_spans = BaseNerTagger._get_entity_spans(gold)
+        for span in pred_spans | gold_spans:
+            entity_counts = counts.setdefault(span[2], [0, 0, 0])
+            if span in pred_spans and span in gold_spans:
+                entity_counts[0] += 1
+            elif span in pred_spans:
+                entity_counts[1] += 1
+            else:
+                entity_counts[2] += 1
+    return {'counts': counts, 'seconds': time.perf_counter() - start}
+
+
+_cross_validation_worker_state = {}
+
+
+def _init_cross_validation_worker(X, Y, folds):
+    _cross_validation_worker_state.update(X=X, Y=Y, folds=folds)
+
+
+def _cross_validate_fold_in_worker(params, fold):
+    X = _cross_validation_worker_state['X']
+    Y = _cross_validation_worker_state['Y']
+    test = _cross_validation_worker_state['folds'][fold]
+    held_out = set(test)
+    train = [i for i in range(len(X)) if i not in held_out]
+    return _cross_validate_crf_fold(params, [X[i] for i in train], [Y[i] for i in train], [X[i] for i in test],
+                                    [Y[i] for i in test])
+
+
+def _precision_recall_f1(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp > 0 else 0.0
+    recall = tp / (tp + fn) if tp + fn > 0 else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'support': tp + fn}
+
+
+def _summarize_fold_results(params, fold_results):
+    totals = {}
+    for result in fold_results:
+        for ent, counts in result['counts'].items():
+            entity_totals = totals.setdefault(ent, [0, 0, 0])
+            for i in range(3):
+                entity_totals[i] += counts[i]
+    micro = [sum(c[i] for c in totals.values()) for i in range(3)]
+    return {
+        'params': params,
+        'per_entity': {ent: _precision_recall_f1(*counts) for ent, counts in sorted(totals.items())},
+        'micro': _precision_recall_f1(*micro),
+    }
 
 
 list_of_colors = "#e6194B, #3cb44b, #ffe119, #4363d8, #f58231, #911eb4, #42d4f4, #f032e6, #bfef45, #fabebe, #469990, " \
@@ -355,16 +1046,17 @@ list_of_colors = list_of_colors.split(', ')
 
 
 class NerTagger:
-    def __init__(self, dataset, unique_tags, data_directory=''):
+    def __init__(self, dataset, unique_tags, data_directory='', **kwargs):
         """
         Initialize the NER tagger with a list of strings and unique tags list.
         Args:
             dataset: list of strings.
             unique_tags: list of ('TagID', 'Tag Name') tuples.
             data_directory: default data directory.
+            kwargs: extra options passed on to BaseNerTagger (e.g. incremental=True)
         """
         self.unique_tags = unique_tags
-        self.ntagger = BaseNerTagger(dataset, data_directory=data_directory)
+        self.ntagger = BaseNerTagger(dataset, data_directory=data_directory, **kwargs)
         self.app = NerTagger._get_app(self.ntagger, self.unique_tags)
         self.utmapping = {t[0]: t[1] for t in self.unique_tags}
 
@@ -428,13 +1120,13 @@ class NerTagger:
                 tag = ex[i][2]
                 if tag[0] in ['B', 'I']:
                     tag = tag[2:]
-                    spans[i].attrs['data-tag-id'] = tagidcounter
+                    spans[i].attrs['data-tag-id'] = str(tagidcounter)
                     spans[i].attrs['data-tag'] = tag
                     spans[i].attrs['class'] = tag
 
                 elif tag[0] in ['L', 'U']:
                     tag = tag[2:]
-                    spans[i].attrs['data-tag-id'] = tagidcounter
+                    spans[i].attrs['data-tag-id'] = str(tagidcounter)
                     spans[i].attrs['data-tag'] = tag
                     spans[i].attrs['class'] = tag
                     tagidcounter += 1
@@ -445,11 +1137,12 @@ class NerTagger:
 
 
     @staticmethod
-    def _render_app_template(unique_tags_data):
+    def _render_app_template(unique_tags_data, url_prefix=''):
         """
         Tag data list of tuples (tag_id, readable_tag_name)
         Args:
             unique_tags_data: list of tag tuples
+            url_prefix: path the app is mounted at, prepended to the urls of the requests made by the page
 
         Returns: html template to render
 
@@ -466,45 +1159,69 @@ class NerTagger:
         for index, item in enumerate(unique_tags_data):
             css_classes.append((item[0], list_of_colors[index]))
 
-        return template.render(css_classes=css_classes, id_color_map=css_classes, tag_controls=unique_tags_data)
+        return template.render(css_classes=css_classes, id_color_map=css_classes, tag_controls=unique_tags_data,
+                               url_prefix=url_prefix)
 
 
     @staticmethod
     def _get_app(ntagger, tags):
         app = Flask(__name__)
+        # the tagger is not thread safe, requests are served one at a time
+        lock = threading.Lock()
 
         @app.route("/")
         def base_app():
-            return NerTagger._render_app_template(tags)
+            return NerTagger._render_app_template(tags, url_prefix=request.script_root)
 
         @app.route('/load_example')
         def load_example():
-            if ntagger.model is None:
-                example = ntagger.get_new_random_example()
-            else:
-                example = ntagger.query_new_example(mode='max')
-
-            html = NerTagger._generate_html_from_example(example)
-            return html
+            with lock:
+                if ntagger.model is None:
+                    example = ntagger.get_new_random_example()
+                else:
+                    example = ntagger.get_next_queued_example(mode='max')
+                if example is None:
+                    return 'No example left to label', 404
+
+                html = NerTagger._generate_html_from_example(example)
+                # every annotator saves the example it loaded, whichever example was loaded last
+                return html, {'X-Example-Id': str(ntagger.current_example['id'])}
+
+        @app.route('/load_batch')
+        def load_batch():
+            with lock:
+                if ntagger.model is None:
+                    return json.dumps([])
+                size = int(request.args.get('size', ntagger.query_batch_size))
+                examples = ntagger.query_new_examples(size=size, mode='max')
+                # the ids are passed back to /save_example
+                return json.dumps([{'id': queued['id'], 'html': NerTagger._generate_html_from_example(example)}
+                                   for queued, example in zip(ntagger.example_queue, examples)])
 
         @app.route('/update_model')
         def update_model():
-            ntagger.update_model()
-            return "Model Updated Successfully"
+            with lock:
+                ntagger.update_model()
+                return "Model Updated Successfully"
 
         @app.route('/save_example', methods=['POST'])
         def save_example():
-            form_data = request.form
-            html = form_data['html']
-            user_tags = NerTagger._get_bilou_tags_from_html(html)
-            ntagger.save_example(user_tags)
-            return 'Success'
+            with lock:
+                form_data = request.form
+                html = form_data['html']
+                if not form_data.get('id', '').isdigit():
+                    return 'Missing example id', 400
+                user_tags = NerTagger._get_bilou_tags_from_html(html)
+                if not ntagger.save_example(user_tags, example_id=int(form_data['id'])):
+                    return 'Unknown or already labelled example, or token count mismatch', 409
+                return 'Success'
 
         @app.route('/save_data')
         def save_tagged_data():
-            print("save_tagged_data")
-            ntagger.save_data()
-            return 'Data Saved'
+            with lock:
+                print("save_tagged_data")
+                ntagger.save_data()
+                return 'Data Saved'
 
         return app
 
@@ -558,18 +1275,21 @@ class NerTagger:
 
         self.ntagger.load_data(filepath)
 
-    def save_model(self, model_filename):
+    def save_model(self, model_filename, compact=False):
         """
         Save ner model to file
         Args:
             model_filename: model filepath
+            compact: save the pruned model (see BaseNerTagger.get_compact_model). It is smaller and predicts
+                almost like the full model.
 
         Returns:
 
         """
 
+        model = self.ntagger.get_compact_model() if compact else self.ntagger.model
         with open(model_filename, 'wb') as out:
-            pickle.dump(self.ntagger.model, out)
+            pickle.dump(model, out)
 
     def load_model(self, model_filename):
         """
@@ -587,17 +1307,79 @@ class NerTagger:
     def update_model(self):
         """
         Updates the model
-        Returns:
+        Returns: dict with the statistics of this update
+
+        """
+
+        return self.ntagger.update_model()
+
+    def evaluate(self, **kwargs):
+        """
+        Cross validate the model on the labelled examples. See BaseNerTagger.evaluate
+        Returns: dict with per entity precision/recall/f1
+
+        """
+        return self.ntagger.evaluate(**kwargs)
+
+    def feature_cache_stats(self):
+        """
+        Usage counters of the unlabelled feature cache
+        Returns: dict with entries, bytes, hits, misses, hit_rate and evictions
 
         """
+        return self.ntagger.feature_cache.stats()
 
-        self.ntagger.update_model()
+    def dedup_stats(self):
+        """
+        Near duplicate collapsing statistics. See BaseNerTagger.dedup_stats
+        Returns: dict of statistics
+
+        """
+        return self.ntagger.dedup_stats()
+
+    def cluster_stats(self):
+        """
+        Cluster cold start statistics. See BaseNerTagger.cluster_stats
+        Returns: dict of statistics
+
+        """
+        return self.ntagger.cluster_stats()
+
+    def compact_model_stats(self, **kwargs):
+        """
+        Size, speed and accuracy of the model and its compact copy. See BaseNerTagger.compact_model_stats
+        Returns: dict of statistics
+
+        """
+        return self.ntagger.compact_model_stats(**kwargs)
+
+    def tune(self, **kwargs):
+        """
+        Search for the best CRF parameters. See BaseNerTagger.tune
+        Returns: list of evaluation results, best first
+
+        """
+        return self.ntagger.tune(**kwargs)
 
     def find_entities_in_text(self, text):
         text = BaseNerTagger._get_pos_tagged_example(text)
         features = BaseNerTagger._sent2features(text)
-        prediction = self.ntagger.model.predict_single(features)
-        lst = zip([t[0] for t in text], prediction)
+        prediction = self.ntagger.get_compact_model().predict_single(features)
+        return NerTagger._get_entities([t[0] for t in text], prediction, self.utmapping)
+
+    @staticmethod
+    def _get_entities(tokens, prediction, utmapping):
+        """
+        Groups BILOU tagged tokens into entities
+        Args:
+            tokens: list of tokens
+            prediction: list of BILOU tags, one per token
+            utmapping: dict of tag identifier -> Readable Name
+
+        Returns: list of {'value': entity text, 'entity': Readable Name} dicts
+
+        """
+        lst = zip(tokens, prediction)
         curr_ent = 'O'
         ent_toks = []
         entities = []
@@ -608,7 +1390,7 @@ class NerTagger:
                 if len(ent_toks) > 0:
                     entities.append({
                         'value': ' '.join(ent_toks),
-                        'entity': self.utmapping[curr_ent],
+                        'entity': utmapping[curr_ent],
                     })
                     ent_toks = []
                 curr_ent = tag[2:]
@@ -623,7 +1405,7 @@ class NerTagger:
                 ent_toks.append(text)
                 entities.append({
                     'value': ' '.join(ent_toks),
-                    'entity': self.utmapping[curr_ent],
+                    'entity': utmapping[curr_ent],
                 })
                 ent_toks = []
             elif tag.startswith('U-'):
@@ -631,13 +1413,13 @@ class NerTagger:
                 ent_toks = []
                 entities.append({
                     'value': text,
-                    'entity': self.utmapping[curr_ent],
+                    'entity': utmapping[curr_ent],
                 })
             elif tag.startswith('O'):
                 if len(ent_toks) > 0:
                     entities.append({
                         'value': ' '.join(ent_toks),
-                        'entity': self.utmapping[curr_ent],
+                        'entity': utmapping[curr_ent],
                     })
                 ent_toks = []
                 curr_ent = 'O'
@@ -645,7 +1427,7 @@ class NerTagger:
         if len(ent_toks) > 0:
             entities.append({
                 'value': ' '.join(ent_toks),
-                'entity': self.utmapping[curr_ent],
+                'entity': utmapping[curr_ent],
             })
         return entities
 
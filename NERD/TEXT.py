@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.linear_model import SGDClassifier
 import numpy as np
+from scipy import sparse
 from scipy.stats import entropy
 import pickle
 import os
+import json
+import hashlib
+import time
+import threading
 
 from flask import Flask
 from flask import request
@@ -14,11 +21,21 @@ import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.pipeline import make_pipeline, FeatureUnion
 import re
+import itertools
 
 from sklearn.base import TransformerMixin
 from sklearn.pipeline import Pipeline
-from nltk import pos_tag, word_tokenize
+from nltk import pos_tag, pos_tag_sents, word_tokenize
 import unicodedata
+import heapq
+
+from NERD.archive import ARCHIVE_EXTENSION, ColumnArchive
+from NERD.cache import LRUCache
+from NERD.dedup import NearDuplicateIndex
+from NERD.parallel import run_tasks, stream_tasks
+from NERD.sampling import ClusterSampler
+from NERD.selection import select_diverse
+from NERD.store import ColumnStore, IndexSet
 
 
 class ColumnsSelector(TransformerMixin):
@@ -52,16 +69,169 @@ class ToDense(TransformerMixin):
         return self
 
     def transform(self, X):
-        return X.todense()
+        return X.toarray()
 
 
-class DefaultTextFeaturizer(TransformerMixin):
+class ToSparse(TransformerMixin):
     def __init__(self):
         pass
 
     def fit(self, X, y=None):
         return self
 
+    def transform(self, X):
+        return sparse.csr_matrix(np.asarray(X, dtype=np.float64))
+
+
+_token_re = re.compile(r'[\w+\(\),:;\[\]]+')
+
+# character class lookup tables over ascii codes, cleaned up text is ascii only
+_ascii = [chr(i) for i in range(256)]
+_upper_chars = np.array([c.isascii() and c.isupper() for c in _ascii], dtype=np.uint8)
+_digit_chars = np.array([c.isascii() and c.isdigit() for c in _ascii], dtype=np.uint8)
+_symbol_chars = np.array([re.match(r'\W', c) is not None for c in _ascii], dtype=np.uint8)
+
+
+# column of the row frames holding the position of each row, used to look rows up in precomputed matrices
+ROW_ID_COLUMN = 'row_id'
+
+
+class HashedTextVectorizer(TransformerMixin):
+    """
+    Hashed word n-gram counts of the 'text' column with a fixed feature dimension and no vocabulary.
+    When `matrix` is set, rows carrying a ROW_ID_COLUMN are looked up in it instead of being re-vectorized.
+    """
+
+    def __init__(self, n_features=2 ** 20, ngram_range=(1, 2)):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.matrix = None
+
+    def _get_vectorizer(self):
+        return HashingVectorizer(n_features=self.n_features, ngram_range=self.ngram_range, alternate_sign=False,
+                                 norm=None)
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        if self.matrix is not None and ROW_ID_COLUMN in X.columns:
+            return self.matrix[X[ROW_ID_COLUMN].values]
+        return self._get_vectorizer().transform(X['text'])
+
+    def transform_chunked(self, texts, chunk_size=10000):
+        """
+        Vectorizes texts chunk by chunk
+        Args:
+            texts: list/Series of strings
+            chunk_size: number of texts per chunk
+
+        Returns: CSR matrix
+
+        """
+        vectorizer = self._get_vectorizer()
+        chunks = [vectorizer.transform(texts[i:i + chunk_size]) for i in range(0, len(texts), chunk_size)]
+        if len(chunks) == 0:
+            return sparse.csr_matrix((0, self.n_features), dtype=np.float64)
+        return sparse.vstack(chunks, format='csr')
+
+    def __getstate__(self):
+        # the precomputed matrix belongs to the data set, not the model
+        state = self.__dict__.copy()
+        state['matrix'] = None
+        return state
+
+
+class RowChunkedMatrix:
+    """
+    Row indexable sparse matrix kept as a list of CSR row chunks, so rows can be appended without copying the
+    existing ones. A chunk is merged into the previous one while it has at least as many rows, which keeps
+    the number of chunks logarithmic in the number of rows. The first chunk is never merged.
+    """
+
+    def __init__(self, chunks):
+        """
+        Args:
+            chunks: non empty list of sparse matrices with the same number of columns
+        """
+        self.chunks = [sparse.csr_matrix(chunk) for chunk in chunks]
+        self._update_offsets()
+
+    def _update_offsets(self):
+        self._offsets = np.cumsum([0] + [chunk.shape[0] for chunk in self.chunks])
+
+    @property
+    def shape(self):
+        return int(self._offsets[-1]), self.chunks[0].shape[1]
+
+    def append(self, matrix):
+        """
+        Appends rows
+        Args:
+            matrix: sparse matrix of the new rows
+
+        Returns: index of the first chunk that changed, every later chunk is new or changed too
+
+        """
+        self.chunks.append(sparse.csr_matrix(matrix))
+        while len(self.chunks) > 2 and self.chunks[-2].shape[0] <= self.chunks[-1].shape[0]:
+            last = self.chunks.pop()
+            self.chunks[-1] = sparse.vstack([self.chunks[-1], last], format='csr')
+        self._update_offsets()
+        return len(self.chunks) - 1
+
+    def __getitem__(self, rows):
+        rows = np.asarray(rows)
+        if len(self.chunks) == 1 or len(rows) == 0:
+            return self.chunks[0][rows] if len(self.chunks) == 1 else self.chunks[0][:0]
+        chunk_of = np.searchsorted(self._offsets, rows, side='right') - 1
+        # rows are gathered chunk by chunk, then put back in the requested order
+        order = np.argsort(chunk_of, kind='stable')
+        sorted_rows, sorted_chunks = rows[order], chunk_of[order]
+        bounds = np.searchsorted(sorted_chunks, np.arange(len(self.chunks) + 1))
+        parts = [self.chunks[chunk][sorted_rows[bounds[chunk]:bounds[chunk + 1]] - self._offsets[chunk]]
+                 for chunk in range(len(self.chunks)) if bounds[chunk + 1] > bounds[chunk]]
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return sparse.vstack(parts, format='csr')[inverse]
+
+
+def _pos_tag_batch(texts):
+    """
+    POS strings of a batch of texts, tagged with a single pos_tag_sents call
+    Args:
+        texts: list of text strings
+
+    Returns: list of space separated POS tag strings
+
+    """
+    tagged = pos_tag_sents([word_tokenize(text) for text in texts])
+    return [' '.join(tag for _, tag in tags) for tags in tagged]
+
+
+class DefaultTextFeaturizer(TransformerMixin):
+    def __init__(self, pos_max_length=100, pos_batch_size=500, pos_n_jobs=1, pos_cache_entries=100000):
+        """
+        Args:
+            pos_max_length: only texts shorter than this are POS tagged, longer ones get an empty pos_string
+            pos_batch_size: number of texts POS tagged per task
+            pos_n_jobs: number of worker processes used for POS tagging (None uses all cores)
+            pos_cache_entries: number of POS strings memoized by text hash
+        """
+        self.pos_max_length = pos_max_length
+        self.pos_batch_size = pos_batch_size
+        self.pos_n_jobs = pos_n_jobs
+        self.pos_cache = LRUCache(max_entries=pos_cache_entries)
+
+    def __getstate__(self):
+        # the memoized POS strings are not shipped to worker processes
+        state = self.__dict__.copy()
+        state['pos_cache'] = LRUCache(max_entries=self.pos_cache.max_entries)
+        return state
+
+    def fit(self, X, y=None):
+        return self
+
     @staticmethod
     def _get_nth_token(text, n):
         """
@@ -73,7 +243,7 @@ class DefaultTextFeaturizer(TransformerMixin):
         Returns:
 
         """
-        toks = re.findall('[\w+\(\),:;\[\]]+', text)
+        toks = _token_re.findall(text)
         if len(toks) > n:
             return toks[n]
         else:
@@ -107,6 +277,41 @@ class DefaultTextFeaturizer(TransformerMixin):
         else:
             return ''
 
+    @staticmethod
+    def _text_key(text):
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def _get_pos_strings(self, texts):
+        """
+        POS strings of cleaned up texts. Cached strings are reused, the missing (distinct) texts are
+        tagged in batches over a process pool.
+        Args:
+            texts: list of cleaned up text strings
+
+        Returns: list of POS strings
+
+        """
+        pos_of_text = {}
+        missing = []
+        for text in set(texts):
+            if len(text) >= self.pos_max_length:
+                pos_of_text[text] = ''
+                continue
+            key = DefaultTextFeaturizer._text_key(text)
+            cached = self.pos_cache.get(key)
+            if cached is not None:
+                pos_of_text[text] = cached
+            else:
+                missing.append((key, text))
+
+        tasks = [([text for _, text in missing[start:start + self.pos_batch_size]],)
+                 for start in range(0, len(missing), self.pos_batch_size)]
+        tagged = itertools.chain.from_iterable(run_tasks(_pos_tag_batch, tasks, n_jobs=self.pos_n_jobs))
+        for (key, text), pos_string in zip(missing, tagged):
+            self.pos_cache.put(key, pos_string)
+            pos_of_text[text] = pos_string
+        return [pos_of_text[text] for text in texts]
+
     @staticmethod
     def _is_alpha_and_numeric(string):
         toret = ''
@@ -134,73 +339,351 @@ class DefaultTextFeaturizer(TransformerMixin):
 
         return toret
 
+    @staticmethod
+    def _get_char_counts(texts):
+        """
+        Counts upper case, digit and non word characters of cleaned up (ascii) texts in one vectorized pass
+        Args:
+            texts: list of cleaned up text strings
+
+        Returns: (lengths, capitals, digits, symbols) integer arrays
+
+        """
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        chars = np.frombuffer(''.join(texts).encode('ascii'), dtype=np.uint8)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        non_empty = lengths > 0
+        counts = []
+        for table in (_upper_chars, _digit_chars, _symbol_chars):
+            count = np.zeros(len(texts), dtype=np.int64)
+            if len(chars) > 0:
+                count[non_empty] = np.add.reduceat(table[chars], offsets[non_empty], dtype=np.int64)
+            counts.append(count)
+        return (lengths,) + tuple(counts)
+
+    @staticmethod
+    def _get_word_features(text):
+        """
+        Calculates the word level features of a cleaned up text in a single pass over its tokens
+        Args:
+            text: cleaned up text string
+
+        Returns: tuple (num_words, num_unique_words, first, second and third token class,
+                        title_word_count, numeric_tokens, capital_tokens)
+
+        """
+        words = text.split()
+        # only the first three tokens are needed
+        toks = [m.group() for m in itertools.islice(_token_re.finditer(text), 3)]
+        toks += [''] * (3 - len(toks))
+        return (
+            len(words),
+            len(set(words)),
+            DefaultTextFeaturizer._is_alpha_and_numeric(toks[0]),
+            DefaultTextFeaturizer._is_alpha_and_numeric(toks[1]),
+            DefaultTextFeaturizer._is_alpha_and_numeric(toks[2]),
+            sum(map(str.istitle, words)),
+            sum(map(str.isdigit, words)),
+            sum(map(str.isupper, words)),
+        )
+
     def transform(self, X):
-        data = pd.DataFrame(data={'text': X})
-        data.text = data.text.apply(lambda x: DefaultTextFeaturizer._cleanup_string(x))
-        data["pos_string"] = data.text.apply(lambda x: DefaultTextFeaturizer._get_pos_string(x))
-        data['text_feature_text_length'] = data['text'].apply(lambda x: len(x))
-        data['text_feature_capitals'] = data['text'].apply(lambda comment: sum(1 for c in comment if c.isupper()))
-        data['text_feature_digits'] = data['text'].apply(lambda comment: sum(1 for c in comment if c.isdigit()))
-        data['text_feature_caps_vs_length'] = data.apply(
-            lambda row: row['text_feature_capitals'] / (row['text_feature_text_length'] + 0.001), axis=1)
-        data['text_feature_num_symbols'] = data['text'].apply(lambda comment: len(re.findall('\W', comment)))
-        data['text_feature_num_words'] = data['text'].apply(lambda comment: len(comment.split()))
-        data['text_feature_num_unique_words'] = data['text'].apply(lambda comment: len(set(w for w in comment.split())))
-        data['text_feature_words_vs_unique'] = data['text_feature_num_unique_words'] / (
-                data['text_feature_num_words'] + 0.001)
-
-        data['text_feature_first_token'] = data['text'].apply(
-            lambda x: DefaultTextFeaturizer._is_alpha_and_numeric(DefaultTextFeaturizer._get_nth_token(x, 0)))
-        data['text_feature_second_token'] = data['text'].apply(
-            lambda x: DefaultTextFeaturizer._is_alpha_and_numeric(DefaultTextFeaturizer._get_nth_token(x, 1)))
-        data['text_feature_third_token'] = data['text'].apply(
-            lambda x: DefaultTextFeaturizer._is_alpha_and_numeric(DefaultTextFeaturizer._get_nth_token(x, 2)))
-
-        data['text_feature_title_word_count'] = data['text'].apply(lambda x: sum(1 for c in x.split() if c.istitle()))
-        data['text_feature_title_word_total_word_ratio'] = data['text_feature_title_word_count'] / (
-                data['text_feature_num_words'] + 0.001)
-        data['text_feature_numeric_tokens'] = data['text'].apply(lambda x: sum(1 for c in x.split() if c.isdigit()))
-        data['text_feature_capital_tokens'] = data['text'].apply(lambda x: sum(1 for c in x.split() if c.isupper()))
-
-        return data.drop(columns=['text'])
+        index = X.index if isinstance(X, pd.Series) else None
+        texts = [DefaultTextFeaturizer._cleanup_string(x) for x in X]
+        lengths, capitals, digits, symbols = DefaultTextFeaturizer._get_char_counts(texts)
+        (num_words, num_unique_words, first_token, second_token, third_token, title_words, numeric_tokens,
+         capital_tokens) = zip(*[DefaultTextFeaturizer._get_word_features(x) for x in texts]) if texts else [()] * 8
+        num_words = np.array(num_words, dtype=np.int64)
+        num_unique_words = np.array(num_unique_words, dtype=np.int64)
+        title_words = np.array(title_words, dtype=np.int64)
+
+        data = pd.DataFrame(data={
+            'pos_string': self._get_pos_strings(texts),
+            'text_feature_text_length': lengths,
+            'text_feature_capitals': capitals,
+            'text_feature_digits': digits,
+            'text_feature_caps_vs_length': capitals / (lengths + 0.001),
+            'text_feature_num_symbols': symbols,
+            'text_feature_num_words': num_words,
+            'text_feature_num_unique_words': num_unique_words,
+            'text_feature_words_vs_unique': num_unique_words / (num_words + 0.001),
+            'text_feature_first_token': pd.Series(first_token, dtype=object),
+            'text_feature_second_token': pd.Series(second_token, dtype=object),
+            'text_feature_third_token': pd.Series(third_token, dtype=object),
+            'text_feature_title_word_count': title_words,
+            'text_feature_title_word_total_word_ratio': title_words / (num_words + 0.001),
+            'text_feature_numeric_tokens': np.array(numeric_tokens, dtype=np.int64),
+            'text_feature_capital_tokens': np.array(capital_tokens, dtype=np.int64),
+        })
+        if index is not None:
+            data.index = index
+
+        return data
 
 
 class MultiLabelEncoder(TransformerMixin):
+    """
+    Encodes every non numeric column as integers, 1.. in order of first appearance, 0 for unseen values.
+    """
+
     def __init__(self, inplace=False):
         self.inplace = inplace
 
+    @staticmethod
+    def _is_encoded_column(column):
+        return not pd.api.types.is_numeric_dtype(column.dtype)
+
     def fit(self, X, y=None):
-        self.encoder = {}
-        self.cols = [c for c in X.columns if X[c].dtype.name == 'object']
-        for col in self.cols:
-            col_enc = {}
-            count = 1
-            unique = list(X[col].unique())
-            for u in unique:
-                col_enc[u] = count
-                count += 1
-            self.encoder[col] = col_enc
+        self.cols = [c for c in X.columns if MultiLabelEncoder._is_encoded_column(X[c])]
+        self.encoder = {col: pd.Index(np.asarray(X[col].unique(), dtype=object)) for col in self.cols}
 
         return self
 
+    def _get_categories(self, col):
+        categories = self.encoder[col]
+        if isinstance(categories, dict):
+            # fitted by an older version, mapping value -> code
+            categories = pd.Index(list(categories.keys()), dtype=object)
+            self.encoder[col] = categories
+        return categories
+
+    def _encode(self, column, categories):
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # look the (few) categories up once and take the codes
+            lookup = np.append(categories.get_indexer(column.cat.categories) + 1, 0)
+            return lookup[column.cat.codes.values]
+        return categories.get_indexer(column.values) + 1
+
     def transform(self, X):
         if self.inplace:
             temp = X
         else:
-            temp = X.copy()
+            # the encoded columns are replaced, the others are shared with X
+            temp = X.copy(deep=False)
 
         for col in self.cols:
-            temp[col] = temp[col].apply(lambda x: self.encoder[col].get(x, 0))
+            temp[col] = self._encode(X[col], self._get_categories(col))
 
         return temp
 
 
+class HashedFeatureEncoder(TransformerMixin):
+    """
+    Stateless sparse encoding of the hand crafted features: numeric columns are log scaled and
+    categorical columns are hashed into n_features one-hot buckets.
+    """
+
+    def __init__(self, n_features=2 ** 10):
+        self.n_features = n_features
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        is_numeric = np.array([pd.api.types.is_numeric_dtype(dtype) for dtype in X.dtypes])
+        categorical = [c for c, numeric in zip(X.columns, is_numeric) if not numeric]
+        values = X.to_numpy(dtype=object)
+        numeric_data = sparse.csr_matrix(np.log1p(np.maximum(values[:, is_numeric].astype(np.float64), 0)))
+        hasher = FeatureHasher(n_features=self.n_features, input_type='string', alternate_sign=False)
+        categorical_data = hasher.transform(
+            [f'{c}={v}' for c, v in zip(categorical, row)] for row in values[:, ~is_numeric])
+        return sparse.hstack([numeric_data, categorical_data], format='csr')
+
+
+class OnlineTextModel:
+    """
+    Linear text classifier over stateless hashed features that can be updated one example at a time.
+    """
+
+    def __init__(self, feature_columns, classes, n_features=2 ** 20, epochs=5):
+        """
+        Args:
+            feature_columns: hand crafted feature columns
+            classes: list of all the possible classes
+            n_features: feature dimension of the hashed n-grams
+            epochs: passes over the data on a full refit
+        """
+        self.feature_columns = feature_columns
+        self.classes = list(classes)
+        self.epochs = epochs
+        self.text_vectorizer = HashedTextVectorizer(n_features=n_features)
+        self.feature_encoder = HashedFeatureEncoder()
+        self.clf = None
+
+    @property
+    def classes_(self):
+        return self.clf.classes_
+
+    def transform(self, X):
+        return sparse.hstack([self.text_vectorizer.transform(X),
+                              self.feature_encoder.transform(X[self.feature_columns])], format='csr')
+
+    def _new_classifier(self):
+        return SGDClassifier(loss='log_loss', alpha=1e-4)
+
+    def partial_fit(self, X, y):
+        """
+        Updates the model with a few labelled rows
+        Args:
+            X: DataFrame with the text and feature columns
+            y: classes
+
+        Returns: self
+
+        """
+        if self.clf is None:
+            self.clf = self._new_classifier()
+        self.clf.partial_fit(self.transform(X), np.asarray(y), classes=self.classes)
+        return self
+
+    def fit(self, X, y):
+        """
+        Retrains the model from scratch
+        Args:
+            X: DataFrame with the text and feature columns
+            y: classes
+
+        Returns: self
+
+        """
+        Xt = self.transform(X)
+        y = np.asarray(y)
+        self.clf = self._new_classifier()
+        for _ in range(self.epochs):
+            order = np.random.permutation(len(y))
+            self.clf.partial_fit(Xt[order], y[order], classes=self.classes)
+        return self
+
+    def predict_proba(self, X):
+        return self.clf.predict_proba(self.transform(X))
+
+    def predict(self, X):
+        return self.clf.predict(self.transform(X))
+
+
+def _predict_entropy_chunk(model, data):
+    """
+    Uncertainty (entropy of the predicted class probabilities) of a chunk of rows
+    Args:
+        model: fitted text classification pipeline
+        data: DataFrame of rows to score
+
+    Returns: array of entropies
+
+    """
+    proba = model.predict_proba(data)
+    return entropy(proba.T)
+
+
+_score_worker_state = {}
+
+
+def _init_score_worker(model):
+    _score_worker_state['model'] = model
+
+
+def _score_chunk_in_worker(data):
+    return _predict_entropy_chunk(_score_worker_state['model'], data)
+
+
+def _fit_model(model, X, y):
+    """
+    Fits a model, e.g. in a worker of a shared pool
+    Returns: the fitted model
+
+    """
+    return model.fit(X, y)
+
+
+def _iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _classify_chunk(model, feature_transformer, texts):
+    """
+    Featurizes a chunk of raw texts and predicts their class probabilities
+    Args:
+        model: fitted text classification pipeline (or OnlineTextModel)
+        feature_transformer: fitted feature transformer of the classifier
+        texts: list of text strings
+
+    Returns: (classes, probabilities) with one row of probabilities per text
+
+    """
+    data = pd.DataFrame(data={'text': texts})
+    feature_data = feature_transformer.transform(data['text'])
+    for col in feature_data.columns:
+        data[col] = feature_data[col].values
+    return model.classes_, model.predict_proba(data)
+
+
+# model and feature transformer of a classify_texts worker process, installed once per worker
+_classify_worker_state = {}
+
+
+def _init_classify_worker(model, feature_transformer):
+    _classify_worker_state['model'] = model
+    _classify_worker_state['feature_transformer'] = feature_transformer
+
+
+def _classify_chunk_in_worker(texts):
+    return _classify_chunk(_classify_worker_state['model'], _classify_worker_state['feature_transformer'], texts)
+
+
+def _model_feature_columns(model):
+    """
+    Args:
+        model: text classification pipeline (or OnlineTextModel)
+
+    Returns: list of the hand crafted feature columns the model reads
+
+    """
+    if isinstance(model, OnlineTextModel):
+        return list(model.feature_columns)
+    featurizer = dict(model.named_steps['fu'].transformer_list)['text_featurizer']
+    return list(featurizer.steps[0][1].cols)
+
+
+def load_text_model(model_filename):
+    """
+    Loads a model saved by TextClassifier.save_model
+    Args:
+        model_filename: source filename
+
+    Returns: (model, feature transformer). Models saved without their feature transformer get a
+        DefaultTextFeaturizer, provided it calculates the features the model reads.
+
+    """
+    with open(model_filename, 'rb') as inp:
+        saved = pickle.load(inp)
+    if isinstance(saved, dict):
+        return saved['model'], saved['feature_transformer']
+    feature_transformer = DefaultTextFeaturizer()
+    columns = feature_transformer.transform(pd.Series(['']))
+    missing = set(_model_feature_columns(saved)) - set(columns.columns)
+    if len(missing) > 0:
+        raise ValueError(f'{model_filename} was saved without its feature transformer and reads features the '
+                         f'default one does not calculate ({", ".join(sorted(missing))}). '
+                         f'Save it again with TextClassifier.save_model.')
+    return saved, feature_transformer
+
+
 class BaseTextClassifier:
     """
     A utility class for Text Classification
     """
 
-    def __init__(self, unlabelled, labelled=None, feature_transformer=None, data_directory=''):
+    def __init__(self, unlabelled, labelled=None, feature_transformer=None, data_directory='', query_batch_size=10,
+                 query_diversity=0.5, vectorizer='count', hashing_n_features=2 ** 16, hashing_chunk_size=10000,
+                 score_chunk_size=10000, score_n_jobs=1, score_heap_size=1000, score_sample_size=None, online=False,
+                 classes=None, rf_n_estimators=100, rf_n_jobs=None, rf_warm_start=False, rf_trees_per_update=10,
+                 rf_max_estimators=500, dedup=False, dedup_threshold=0.8, propagate_labels=False, cold_start='random',
+                 n_clusters=50, online_refresh_size=100, store_float32=False):
         """
         Initialize with a DataFrame(['text']) and/or DataFrame(['text', 'class'])
         Args:
@@ -208,15 +691,80 @@ class BaseTextClassifier:
             labelled: DataFrame(['text', 'class'])
             feature_transformer: Sklearn transformer to calculate extra features
             data_directory: Default data directory
+            query_batch_size: number of examples selected per active learning scoring pass
+            query_diversity: weight of the redundancy penalty used when selecting a batch
+            vectorizer: text vectorizer of the model
+                - count (Default): n-gram vocabulary refitted on every update
+                - hashing: fixed size hashed n-grams. The pool is vectorized once, in chunks, and the
+                  matrix is cached on disk and reused by every update. Appended rows are stored as extra
+                  matrix chunks.
+            hashing_n_features: feature dimension of the hashing vectorizer. The random forest pays for every
+                column at every node, so training time grows about linearly with it (3k rows, 400 labels:
+                0.2s at 2 ** 16, 2.6s at 2 ** 20). Narrower matrices map more n-grams to the same column.
+            hashing_chunk_size: number of texts vectorized at a time in hashing mode
+            score_chunk_size: number of unlabelled rows scored at a time
+            score_n_jobs: number of worker processes used for scoring (None uses all cores)
+            score_heap_size: number of most uncertain rows kept per scoring pass
+            score_sample_size: if set, each scoring pass only scores a random sample of this many unlabelled rows
+            online: use an OnlineTextModel updated on every saved example instead of a RandomForest
+                refitted on update_model. update_model still does a full refit. After a label only the
+                score_heap_size cached candidates and online_refresh_size random rows are rescored, update_model
+                rescores the pool.
+            classes: list of all the possible classes. Required in online mode.
+            rf_n_estimators: number of trees of a fully refitted RandomForest
+            rf_n_jobs: number of cores used by the RandomForest for training and prediction (None: 1, -1: all)
+            rf_warm_start: on update, grow rf_trees_per_update trees on the current labels and keep the
+                existing ones instead of rebuilding the forest. The feature encoding (e.g. the n-gram vocabulary)
+                is frozen at the last full refit.
+            rf_trees_per_update: number of trees added per warm started update
+            rf_max_estimators: the forest is rebuilt from scratch once it would grow beyond this many trees
+            dedup: collapse near duplicate unlabelled texts (MinHash/LSH over token shingles). Only the first text
+                of a group is featurized, scored and shown.
+            dedup_threshold: minimum estimated shingle Jaccard similarity of near duplicates
+            propagate_labels: when a group representative is labelled, its duplicates are added with the same
+                class on the next update_model/save_data. Duplicates of already labelled rows are dropped.
+            cold_start: how get_new_random_example picks examples
+                - random (Default): uniformly at random
+                - cluster: representative examples spread over n_clusters clusters of the pool (see
+                  ClusterSampler). The clusters also penalize same-cluster examples in batch queries.
+            n_clusters: number of clusters of the cluster cold start
+            online_refresh_size: number of random unlabelled rows rescored, with the cached candidates, after an
+                online update
+            store_float32: store the float feature columns as float32, halving their memory at the cost of
+                precision
         """
-        self.unlabelled = pd.DataFrame(data={'text': unlabelled})
+        if online and classes is None:
+            raise ValueError('classes are required in online mode')
+        if cold_start not in ('random', 'cluster'):
+            raise ValueError(f'Unknown cold start {cold_start}')
+        start = time.perf_counter()
+        self.data_directory = os.path.join(data_directory, 'Text_Classification_Data')
+        os.makedirs(self.data_directory, exist_ok=True)
+
         self.labelled = labelled
 
+        # rows are never removed, a row id is the position of the row in the store
+        self.store = ColumnStore(float32=store_float32)
+        self.unlabelled_rows = IndexSet()
+        self.labelled_rows = IndexSet()
+        self.cluster_sampler = ClusterSampler(n_clusters=n_clusters) if cold_start == 'cluster' else None
+        self.dedup_index = NearDuplicateIndex(threshold=dedup_threshold) if dedup else None
+        self.propagate_labels = propagate_labels
+        # representative row -> texts of its duplicates, kept for label propagation
+        self.duplicate_texts = {}
+        # rows whose duplicates have been propagated, and the (text, class) pairs not added yet
+        self._propagated_rows = set()
+        self._pending_propagated = []
+        self.n_propagated = 0
+        # one dict of statistics per batch of unlabelled texts added
+        self.ingestion_history = []
+        # archive path -> rows already saved to it
+        self._archived_rows = {}
+        unlabelled = list(unlabelled)
+        kept = self._filter_duplicates(unlabelled)
+        self._add_store_rows(pd.DataFrame(data={'text': kept}))
         if self.labelled is not None:
-            self.all_data = pd.concat([self.unlabelled, self.labelled])
-        else:
-            self.all_data = self.unlabelled
-            self.all_data['class'] = np.nan
+            self._add_store_rows(self.labelled[['text', 'class']])
 
         # extra feature functions
         if feature_transformer is None:
@@ -225,108 +773,673 @@ class BaseTextClassifier:
             self.feature_transformer = feature_transformer
 
         self._refresh_text_feature_data()
+        self._record_ingestion(len(unlabelled), len(kept), start)
+
+        if vectorizer not in ('count', 'hashing'):
+            raise ValueError(f'Unknown vectorizer {vectorizer}')
+        self.vectorizer = vectorizer
+        self.online = online
+        self.classes = classes
+        self.rf_n_estimators = rf_n_estimators
+        self.rf_n_jobs = rf_n_jobs
+        self.rf_warm_start = rf_warm_start
+        self.rf_trees_per_update = rf_trees_per_update
+        self.rf_max_estimators = rf_max_estimators
+        self.training_history = []
+        # rows the current model was trained on
+        self._fitted_rows = set()
+        self.hashed_vectorizer = HashedTextVectorizer(n_features=hashing_n_features)
+        self.hashing_chunk_size = hashing_chunk_size
+        self.text_matrix = None
+        if self.vectorizer == 'hashing':
+            self._load_or_build_text_matrix()
 
         self.model = None
-        self.data_directory = os.path.join(data_directory, 'Text_Classification_Data')
-        os.makedirs(self.data_directory, exist_ok=True)
+        self.query_batch_size = query_batch_size
+        self.query_diversity = query_diversity
+        # row indices selected by the last batch query, not yet shown
+        self.example_queue = []
+
+        self.score_chunk_size = score_chunk_size
+        self.score_n_jobs = score_n_jobs
+        self.score_heap_size = score_heap_size
+        self.score_sample_size = score_sample_size
+        # optional shared process pool (e.g. of a ProjectServer) used for scoring and model fitting
+        self.executor = None
+        # uncertainty scores are computed once per model version and kept in a heap of (-entropy, row)
+        self._model_version = 0
+        self._score_heap = []
+        self._score_heap_version = None
+        # model version the heap can be brought to by rescoring its rows, set by the online updates
+        self._online_rescore_version = None
+        self.online_refresh_size = online_refresh_size
+
+    @property
+    def all_data(self):
+        """
+        Read only DataFrame of all the rows, built from the store on every access. Changes to it are not stored:
+        rows are added with add_unlabelled_examples and labels with save_example.
+        """
+        return self._get_frame()
+
+    @all_data.setter
+    def all_data(self, value):
+        raise AttributeError('all_data is read only, add rows with add_unlabelled_examples and labels with '
+                             'save_example')
+
+    def _get_frame(self, rows=None, columns=None):
+        """
+        Args:
+            rows: row ids (None for all the rows)
+            columns: store columns (None for all)
+
+        Returns: DataFrame indexed by row id, with a ROW_ID_COLUMN
+
+        """
+        frame = self.store.frame(rows, columns)
+        frame[ROW_ID_COLUMN] = frame.index.values
+        return frame
+
+    def _add_store_rows(self, new_rows, feature_data=None):
+        """
+        Appends rows to the store and updates the labelled/unlabelled row sets
+        Args:
+            new_rows: DataFrame(['text']) or DataFrame(['text', 'class'])
+            feature_data: DataFrame of the feature columns of the new rows
+
+        Returns: array of the new row ids
+
+        """
+        if 'class' in new_rows.columns:
+            classes = np.array([None if pd.isna(c) else c for c in new_rows['class']], dtype=object)
+        else:
+            classes = np.full(len(new_rows), None, dtype=object)
+        data = {'text': np.asarray(new_rows['text'], dtype=object), 'class': classes}
+        if feature_data is not None:
+            for col in self.feature_columns:
+                data[col] = feature_data[col].values
+        rows = self.store.append(data)
+        for row, cls in zip(rows, classes):
+            if cls is None:
+                self.unlabelled_rows.add(row)
+            else:
+                self.labelled_rows.add(row)
+        if self.cluster_sampler is not None:
+            unlabelled = [i for i, cls in enumerate(classes) if cls is None]
+            self.cluster_sampler.add([int(rows[i]) for i in unlabelled], [data['text'][i] for i in unlabelled])
+        return rows
+
+    def _filter_duplicates(self, texts):
+        """
+        Drops the near duplicates of the unlabelled texts added so far (and of each other)
+        Args:
+            texts: list of strings
+
+        Returns: list of the texts to add
+
+        """
+        if self.dedup_index is None:
+            return texts
+        kept = []
+        for text in texts:
+            # kept texts are appended in order, so the row id of a new representative is known in advance
+            representative = self.dedup_index.add(len(self.store) + len(kept), text)
+            if representative is None:
+                kept.append(text)
+            elif self.propagate_labels and representative not in self._propagated_rows:
+                self.duplicate_texts.setdefault(representative, []).append(text)
+        return kept
+
+    def _record_ingestion(self, n_texts, n_added, start):
+        elapsed = time.perf_counter() - start
+        self.ingestion_history.append({
+            'texts': n_texts,
+            'added': n_added,
+            'duplicates': n_texts - n_added,
+            'seconds': elapsed,
+            'texts_per_second': n_texts / elapsed if elapsed > 0 else 0.0,
+        })
+
+    def _propagate_label(self, row, label):
+        self._propagated_rows.add(row)
+        texts = self.duplicate_texts.pop(row, [])
+        self._pending_propagated.extend((text, label) for text in texts)
+        self.n_propagated += len(texts)
+
+    def _flush_propagated_labels(self):
+        """
+        Adds the duplicates labelled by propagation as labelled rows. They are batched because
+        appending rows re-featurizes them (and writes a hashed text matrix chunk).
+        """
+        if len(self._pending_propagated) == 0:
+            return
+        texts, labels = zip(*self._pending_propagated)
+        self._pending_propagated = []
+        self._append_rows(pd.DataFrame(data={'text': list(texts), 'class': list(labels)}))
+
+    def dedup_stats(self):
+        """
+        Near duplicate collapsing statistics
+        Returns: dict with the texts seen, representatives, duplicates, shrinkage of the pool, dedup throughput,
+            pool size and number of propagated labels
+
+        """
+        stats = self.dedup_index.stats() if self.dedup_index is not None else {}
+        stats['pool'] = len(self.unlabelled_rows)
+        stats['propagated'] = self.n_propagated
+        return stats
+
+    def cluster_stats(self):
+        """
+        Cluster cold start statistics
+        Returns: dict with the clusters, indexed and available rows, cluster sizes, number of clusters
+            sampled from and clustering time (empty without the cluster cold start)
+
+        """
+        return self.cluster_sampler.stats() if self.cluster_sampler is not None else {}
 
     def _refresh_text_feature_data(self):
-        feature_data = self.feature_transformer.fit_transform(self.all_data['text'])
+        """
+        Refits the feature transformer and recalculates the features of every row.
+        Only needed when the feature transformer changes, new rows are featurized by _append_rows.
+        """
+        feature_data = self.feature_transformer.fit_transform(pd.Series(self.store.get_column('text')))
         self.feature_columns = list(feature_data.columns)
         for col in feature_data.columns:
-            self.all_data[col] = feature_data[col]
+            self.store.set_column(col, BaseTextClassifier._compact_feature_column(feature_data[col]))
+
+    @staticmethod
+    def _compact_feature_column(column):
+        # string valued features (pos_string, token classes) are stored as categoricals
+        if pd.api.types.is_object_dtype(column.dtype) or pd.api.types.is_string_dtype(column.dtype):
+            return column.astype('category')
+        return column
+
+    def _text_matrix_paths(self):
+        return (os.path.join(self.data_directory, 'hashed_text_matrix.npz'),
+                os.path.join(self.data_directory, 'hashed_text_matrix.json'))
+
+    def _text_matrix_chunk_path(self, chunk):
+        # the first chunk keeps the name of the single file matrix
+        if chunk == 0:
+            return self._text_matrix_paths()[0]
+        return os.path.join(self.data_directory, f'hashed_text_matrix_{chunk}.npz')
+
+    @staticmethod
+    def _chain_text_digest(digest, texts):
+        """
+        Extends an order sensitive digest of texts, so appending texts does not rehash the previous ones
+        Args:
+            digest: digest bytes of the previous texts (b'' for none)
+            texts: iterable of strings
+
+        Returns: digest bytes
+
+        """
+        for text in texts:
+            digest = hashlib.blake2b(digest + text.encode('utf-8'), digest_size=16).digest()
+        return digest
+
+    def _text_fingerprint(self):
+        return {
+            'rows': len(self.store),
+            'n_features': self.hashed_vectorizer.n_features,
+            'ngram_range': list(self.hashed_vectorizer.ngram_range),
+            'texts': self._text_digest.hex(),
+        }
+
+    def _load_or_build_text_matrix(self):
+        """
+        Loads the cached hashed text matrix if it was built from the same texts, else vectorizes the pool
+        chunk by chunk and caches the matrix on disk.
+        """
+        matrix_path, meta_path = self._text_matrix_paths()
+        self._text_digest = BaseTextClassifier._chain_text_digest(b'', self.store.get_column('text'))
+        fingerprint = self._text_fingerprint()
+        if os.path.exists(matrix_path) and os.path.exists(meta_path):
+            with open(meta_path) as inp:
+                cached = json.load(inp)
+            paths = [self._text_matrix_chunk_path(chunk) for chunk in range(cached.pop('chunks', 1))]
+            if cached == fingerprint and all(os.path.exists(path) for path in paths):
+                text_matrix = RowChunkedMatrix([sparse.load_npz(path) for path in paths])
+                # an interrupted append may have left merged chunks behind
+                if text_matrix.shape[0] == fingerprint['rows']:
+                    self.text_matrix = text_matrix
+                    return
+        self.text_matrix = RowChunkedMatrix([self.hashed_vectorizer.transform_chunked(self.store.get_column('text'),
+                                                                                      self.hashing_chunk_size)])
+        self._save_text_matrix()
+
+    def _save_text_matrix(self, first_chunk=0, n_previous_chunks=0):
+        """
+        Writes the text matrix chunks from first_chunk on, removes the files of the chunks merged away and
+        updates the fingerprint
+        Args:
+            first_chunk: first chunk that changed since the last save
+            n_previous_chunks: number of chunks at the last save
+
+        Returns:
+
+        """
+        chunks = self.text_matrix.chunks
+        for chunk in range(first_chunk, len(chunks)):
+            sparse.save_npz(self._text_matrix_chunk_path(chunk), chunks[chunk], compressed=False)
+        for chunk in range(len(chunks), n_previous_chunks):
+            os.remove(self._text_matrix_chunk_path(chunk))
+        meta = self._text_fingerprint()
+        meta['chunks'] = len(chunks)
+        with open(self._text_matrix_paths()[1], 'w') as out:
+            json.dump(meta, out)
+
+    def _append_rows(self, new_rows, feature_data=None):
+        """
+        Featurizes only the new rows with the already fitted feature transformer and appends them to the
+        store, without copying the existing rows
+        Args:
+            new_rows: DataFrame(['text']) or DataFrame(['text', 'class'])
+            feature_data: already computed feature columns of the new rows
+
+        Returns: array of the new row ids
+
+        """
+        new_rows = new_rows.reset_index(drop=True)
+        if feature_data is None:
+            feature_data = self.feature_transformer.transform(new_rows['text'])
+        rows = self._add_store_rows(new_rows, feature_data)
+        if self.vectorizer == 'hashing':
+            new_matrix = self.hashed_vectorizer.transform_chunked(new_rows['text'], self.hashing_chunk_size)
+            n_chunks = len(self.text_matrix.chunks)
+            self._text_digest = BaseTextClassifier._chain_text_digest(self._text_digest, new_rows['text'])
+            self._save_text_matrix(self.text_matrix.append(new_matrix), n_chunks)
+            self.attach_text_matrix()
+        return rows
+
+    def attach_text_matrix(self):
+        """
+        Points the hashing vectorizer of the current model at the precomputed text matrix, e.g. after
+        the model has been loaded from a file.
+        Returns:
+
+        """
+        if self.model is None or self.text_matrix is None:
+            return
+        if isinstance(self.model, OnlineTextModel):
+            transformers = [self.model.text_vectorizer]
+        else:
+            transformers = [transformer for _, transformer in self.model.named_steps['fu'].transformer_list]
+        for transformer in transformers:
+            if isinstance(transformer, HashedTextVectorizer) and transformer.n_features == self.text_matrix.shape[1]:
+                transformer.matrix = self.text_matrix
+
+    def set_feature_transformer(self, feature_transformer):
+        """
+        Replaces the feature transformer and recalculates the features of all rows
+        Args:
+            feature_transformer: Sklearn transformer to calculate extra features
+
+        Returns:
+
+        """
+        self.feature_transformer = feature_transformer
+        self.store.drop_columns(self.feature_columns)
+        self._refresh_text_feature_data()
+        # the model was trained on the old features
+        self.model = None
+        self._model_version += 1
+
+    def classify_texts(self, texts, batch_size=1000, n_jobs=1):
+        """
+        Classifies a stream of texts with the current model. Texts are featurized and scored chunk by chunk,
+        so only a few chunks are in memory at a time.
+        Args:
+            texts: iterable of text strings
+            batch_size: number of texts featurized and scored at a time
+            n_jobs: number of worker processes (None uses all cores). Each worker receives the model once.
+
+        Returns: generator of (class, {class: probability}) tuples, in input order
+
+        """
+        if self.model is None:
+            raise ValueError('The model has not been trained yet')
+        chunks = ((chunk,) for chunk in _iter_chunks(texts, batch_size))
+        if n_jobs == 1:
+            results = (_classify_chunk(self.model, self.feature_transformer, chunk) for chunk, in chunks)
+        else:
+            results = stream_tasks(_classify_chunk_in_worker, chunks, n_jobs=n_jobs,
+                                   initializer=_init_classify_worker, initargs=(self.model, self.feature_transformer))
+        for classes, proba in results:
+            best = np.argmax(proba, axis=1)
+            for i, row in enumerate(proba):
+                yield classes[best[i]], dict(zip(classes, row.tolist()))
 
     def get_new_random_example(self):
         """
         Returns a random example to be tagged. Used to bootstrap the model.
+        With the cluster cold start, examples are representatives of the clusters of the pool.
         Returns:
 
         """
-        unl = self.all_data[self.all_data['class'].isna()].index
-        self.current_example_index = np.random.choice(unl)
-        self.current_example = self.all_data.iloc[self.current_example_index]
+        row = self.cluster_sampler.sample() if self.cluster_sampler is not None else None
+        self.current_example_index = row if row is not None else self.unlabelled_rows.sample()
+        self.current_example = self.store.row(self.current_example_index)
         return self.current_example['text']
 
+    def _is_unlabelled(self, row):
+        return row in self.unlabelled_rows
+
+    def _refresh_scores(self):
+        """
+        Scores the unlabelled rows (or a random sample of them) with the current model, chunk by chunk
+        over a process pool (the shared executor if set, else score_n_jobs processes), and keeps the
+        score_heap_size most uncertain rows in a heap.
+        Chunks are built as the workers consume them, and each worker receives the model once.
+        Returns:
+
+        """
+        unlabelled_rows = self.unlabelled_rows.to_array()
+        if self.score_sample_size is not None and self.score_sample_size < len(unlabelled_rows):
+            unlabelled_rows = np.random.choice(unlabelled_rows, self.score_sample_size, replace=False)
+        chunks = (self._get_frame(unlabelled_rows[start:start + self.score_chunk_size])
+                  for start in range(0, len(unlabelled_rows), self.score_chunk_size))
+        if self.score_n_jobs == 1 and self.executor is None:
+            scores = [_predict_entropy_chunk(self.model, chunk) for chunk in chunks]
+        else:
+            scores = list(stream_tasks(_score_chunk_in_worker, ((chunk,) for chunk in chunks),
+                                       n_jobs=self.score_n_jobs, initializer=_init_score_worker,
+                                       initargs=(self.model,), executor=self.executor))
+        scores = np.concatenate(scores) if len(scores) > 0 else np.zeros(0)
+
+        top = np.argsort(-scores, kind='stable')[:self.score_heap_size]
+        self._score_heap = [(-scores[i], unlabelled_rows[i]) for i in top]
+        heapq.heapify(self._score_heap)
+        self._score_heap_version = self._model_version
+
+    def _rescore_heap(self):
+        """
+        Rescores the unlabelled rows of the heap and online_refresh_size random unlabelled rows with the current
+        model. An online update only moves the model a little, so this replaces a pass over the pool.
+        Returns:
+
+        """
+        rows = [row for _, row in self._score_heap if self._is_unlabelled(row)]
+        rows = np.array(sorted(set(rows).union(self.unlabelled_rows.sample(self.online_refresh_size))), dtype=np.int64)
+        scores = _predict_entropy_chunk(self.model, self._get_frame(rows)) if len(rows) > 0 else np.zeros(0)
+        top = np.argsort(-scores, kind='stable')[:self.score_heap_size]
+        self._score_heap = [(-scores[i], rows[i]) for i in top]
+        heapq.heapify(self._score_heap)
+        self._score_heap_version = self._model_version
+
+    def _get_scores(self):
+        if self._score_heap_version != self._model_version and self._online_rescore_version == self._model_version:
+            self._rescore_heap()
+        if self._score_heap_version != self._model_version or len(self._score_heap) == 0:
+            self._refresh_scores()
+        return self._score_heap
+
     def query_new_example(self, mode='entropy'):
         """
         Returns a new example based on the chosen active learning strategy.
+        Scores are computed once per model version, so this is usually a heap pop.
         Args:
             mode: Active Learning Strategy
-                - max (Default)
-                - mean
+                - entropy (Default)
         Returns:
 
         """
         if mode == 'entropy':
-            unlab = self.all_data[self.all_data['class'].isna()]
-            unlabelled_idx = unlab.index
-            proba = self.model.predict_proba(unlab)
-            proba_idx = np.argmax(entropy(proba.T))
-            actual_idx = unlabelled_idx[proba_idx]
+            heap = self._get_scores()
+            while len(heap) > 0:
+                _, row = heapq.heappop(heap)
+                if self._is_unlabelled(row):
+                    self.current_example_index = row
+                    self.current_example = self.store.row(self.current_example_index)
+                    return self.current_example['text']
+                if len(heap) == 0:
+                    heap = self._get_scores()
+
+    def query_new_examples(self, size=10, mode='entropy', diversity=None, candidates_per_example=10):
+        """
+        Selects a batch of examples from a single scoring pass. The most uncertain examples are
+        picked greedily, penalizing token overlap with the examples already in the batch.
+        The batch is queued and served one by one by get_next_queued_example.
+        Args:
+            size: number of examples in the batch
+            mode: Active Learning Strategy
+                - entropy (Default)
+            diversity: weight of the redundancy penalty in [0, 1]. Defaults to query_diversity.
+            candidates_per_example: the batch is picked from the size * candidates_per_example most
+                uncertain examples
 
-            self.current_example_index = actual_idx
-            self.current_example = self.all_data.iloc[self.current_example_index]
-            return self.current_example['text']
+        Returns: list of texts
 
-    def update_model(self):
         """
-        Updates the model with the currently labelled dataset
-        Returns:
+        if diversity is None:
+            diversity = self.query_diversity
+        if mode == 'entropy':
+            heap = self._get_scores()
+            # drop rows labelled since the scores were computed
+            heap[:] = [item for item in heap if self._is_unlabelled(item[1])]
+            heapq.heapify(heap)
+            if len(heap) == 0:
+                # every scored row got labelled, score the remaining ones
+                heap = self._get_scores()
+            candidates = heapq.nsmallest(size * candidates_per_example, heap)
+            scores = [-score for score, _ in candidates]
+            token_sets = [set(self.store.get_value('text', row).lower().split()) for _, row in candidates]
+            clusters = None
+            if self.cluster_sampler is not None:
+                clusters = [self.cluster_sampler.cluster_of(row) for _, row in candidates]
+            selected = select_diverse(scores, token_sets, size, diversity, clusters=clusters)
+            self.example_queue = [candidates[i][1] for i in selected]
+            return [self.store.get_value('text', idx) for idx in self.example_queue]
+
+    def get_next_queued_example(self, mode='entropy'):
+        """
+        Returns the next example of the current batch. A new batch of query_batch_size examples is
+        queried when the batch is used up.
+        Args:
+            mode: Active Learning Strategy
 
+        Returns: text
+
+        """
+        while len(self.example_queue) > 0:
+            idx = self.example_queue.pop(0)
+            if self._is_unlabelled(idx):
+                self.current_example_index = idx
+                self.current_example = self.store.row(self.current_example_index)
+                return self.current_example['text']
+        self.query_new_examples(size=self.query_batch_size, mode=mode)
+        if len(self.example_queue) == 0:
+            return None
+        return self.get_next_queued_example(mode)
+
+    def _build_model(self):
         """
+        Text classification pipeline. The n-gram counts and the hand crafted features are stacked as one
+        sparse CSR matrix, which the classifier consumes directly.
+        Returns: sklearn Pipeline, or OnlineTextModel in online mode
 
-        if self.model is None:
-            self.model = Pipeline([
-                ('fu', FeatureUnion([
-                    ('text_vectorizer',
-                     make_pipeline(ColumnsSelector('text'), CountVectorizer(ngram_range=(1, 2)), ToDense())),
-                    ('text_featurizer', make_pipeline(ColumnsSelector(self.feature_columns), MultiLabelEncoder()))
-                ])),
-                ('clf', RandomForestClassifier())
-            ])
+        """
+        if self.online:
+            model = OnlineTextModel(self.feature_columns, self.classes, n_features=self.hashed_vectorizer.n_features)
+            model.text_vectorizer.matrix = self.text_matrix
+            return model
+        if self.vectorizer == 'hashing':
+            # rows are looked up in the precomputed matrix by row id
+            text_vectorizer = HashedTextVectorizer(n_features=self.hashed_vectorizer.n_features,
+                                                   ngram_range=self.hashed_vectorizer.ngram_range)
+            text_vectorizer.matrix = self.text_matrix
+        else:
+            text_vectorizer = make_pipeline(ColumnsSelector('text'), CountVectorizer(ngram_range=(1, 2)))
+        return Pipeline([
+            ('fu', FeatureUnion([
+                ('text_vectorizer', text_vectorizer),
+                ('text_featurizer',
+                 make_pipeline(ColumnsSelector(self.feature_columns), MultiLabelEncoder(), ToSparse()))
+            ])),
+            ('clf', RandomForestClassifier(n_estimators=self.rf_n_estimators, n_jobs=self.rf_n_jobs))
+        ])
+
+    def _can_warm_start(self, labels):
+        if not self.rf_warm_start or self.online or not isinstance(self.model, Pipeline):
+            return False
+        clf = self.model.named_steps['clf']
+        if not hasattr(clf, 'estimators_'):
+            return False
+        if clf.n_estimators + self.rf_trees_per_update > self.rf_max_estimators:
+            return False
+        # the existing trees only know the classes seen so far
+        return set(clf.classes_) == set(labels.unique())
 
-        lab = self.all_data[self.all_data['class'].notna()]
-        self.model.fit(lab, lab['class'])
+    def update_model(self):
+        """
+        Updates the model with the currently labelled dataset.
+        Before training, the current model is scored on the rows labelled since the last update (which it
+        has not seen), so `training_history` records the latency and accuracy of each update.
+        With a shared executor the model is fitted in one of its workers.
+        Returns: dict with the statistics of this update
 
-    def save_example(self, data):
         """
-        Saves the current example with the user tagged data
+        self._flush_propagated_labels()
+        lab = self._get_frame(np.sort(self.labelled_rows.to_array()))
+        # the class column is an object column (it holds None for unlabelled rows), sklearn wants e.g. int labels
+        # as an int array
+        labels = lab['class'].infer_objects()
+        new_rows = lab[~lab.index.isin(list(self._fitted_rows))]
+        holdout_accuracy = None
+        # in online mode the model has already learned from the new rows
+        if self.model is not None and len(new_rows) > 0 and not self.online:
+            holdout_accuracy = float(np.mean(self.model.predict(new_rows) == new_rows['class'].values))
+
+        start = time.perf_counter()
+        if self._can_warm_start(labels):
+            mode = 'warm_start'
+            clf = self.model.named_steps['clf']
+            clf.set_params(warm_start=True, n_estimators=clf.n_estimators + self.rf_trees_per_update)
+            clf = run_tasks(_fit_model, [(clf, self.model.named_steps['fu'].transform(lab), labels)],
+                            n_jobs=1, executor=self.executor)[0]
+            self.model.steps[-1] = ('clf', clf)
+        else:
+            mode = 'full'
+            if self.model is None or self.rf_warm_start:
+                self.model = self._build_model()
+            self.model = run_tasks(_fit_model, [(self.model, lab, labels)], n_jobs=1,
+                                   executor=self.executor)[0]
+            # a model fitted in a worker comes back without the text matrix
+            self.attach_text_matrix()
+        elapsed = time.perf_counter() - start
+
+        self._fitted_rows = set(lab.index)
+        self._model_version += 1
+        # queued examples were selected by the previous model
+        self.example_queue = []
+        stats = {
+            'mode': mode,
+            'labelled': len(lab),
+            'train_seconds': elapsed,
+            'holdout_examples': len(new_rows),
+            'holdout_accuracy': holdout_accuracy,
+        }
+        if isinstance(self.model, Pipeline):
+            stats['trees'] = self.model.named_steps['clf'].n_estimators
+        self.training_history.append(stats)
+        return stats
+
+    def save_example(self, data, example_id=None):
+        """
+        Saves the current example, or the unlabelled row example_id, with the user tagged data
         Args:
             data: User tagged data. [list of tags].
+            example_id: row id of the example (e.g. a /load_batch item). Defaults to the current example.
 
-        Returns:
+        Returns: True if the example was saved, False if it is not an unlabelled row
 
         """
-        self.all_data.loc[self.current_example_index, 'class'] = data
+        row = self.current_example_index if example_id is None else example_id
+        if row is None or not self._is_unlabelled(row):
+            return False
+        self.store.set_value('class', row, data)
+        self.unlabelled_rows.discard(row)
+        self.labelled_rows.add(row)
+        if self.cluster_sampler is not None:
+            self.cluster_sampler.discard(row)
+        if self.propagate_labels:
+            self._propagate_label(row, data)
+        if self.online:
+            if self.model is None:
+                self.model = self._build_model()
+            self.model.partial_fit(self._get_frame([row]), [data])
+            # the scores of the previous version are stale, and so is the batch picked with them. If the heap
+            # only misses online updates, rescoring its rows is enough.
+            heap_current = self._model_version in (self._score_heap_version, self._online_rescore_version)
+            self._model_version += 1
+            if heap_current:
+                self._online_rescore_version = self._model_version
+            self.example_queue = []
+        return True
+
+    def _feature_signature(self):
+        # features saved by another transformer (or another configuration of it) are recomputed on load
+        transformer = self.feature_transformer
+        params = {k: v for k, v in sorted(vars(transformer).items()) if isinstance(v, (bool, int, float, str))}
+        return {'transformer': f'{type(transformer).__module__}.{type(transformer).__qualname__}',
+                'params': params, 'columns': self.feature_columns}
 
     def save_data(self, filepath=None):
         """
         Saves the labelled data to a file
         Args:
-            filepath: file to save the data in a pickle format.
+            filepath: CSV file, or a compressed columnar archive if it ends with .nerd. Labelled rows not
+                saved to the archive yet are appended to it, with their features, as a new chunk.
 
         Returns:
 
         """
         if filepath is None:
             filepath = os.path.join(self.data_directory, 'text_classification_data.csv')
-        self.all_data[['text', 'class']].to_csv(filepath, index=False)
+        self._flush_propagated_labels()
+        if not filepath.endswith(ARCHIVE_EXTENSION):
+            self.store.frame(columns=['text', 'class']).to_csv(filepath, index=False)
+            return
+        path = os.path.abspath(filepath)
+        if not os.path.exists(path):
+            self._archived_rows[path] = set()
+        archived = self._archived_rows.setdefault(path, set())
+        rows = [row for row in self.labelled_rows if row not in archived]
+        if len(rows) == 0:
+            return
+        rows.sort()
+        ColumnArchive(path).append({column: self.store.get_column(column, rows)
+                                    for column in ['text', 'class'] + self.feature_columns},
+                                   metadata={'features': self._feature_signature()})
+        archived.update(rows)
 
     def load_data(self, filepath=None):
         """
         Loads labelled data from file.|
         Args:
-            filepath: file containing pickeled labelled dataset
+            filepath: CSV file, or a compressed columnar archive if it ends with .nerd. The features saved
+                in an archive are reused if they were computed by the same feature transformer.
 
         Returns:
 
         """
         if filepath is None:
             filepath = os.path.join(self.data_directory, 'text_classification_data.csv')
-        self.labelled = pd.read_csv(filepath)
-        self.all_data = pd.concat([self.all_data, self.labelled])
-        self.all_data.reset_index(inplace=True)
-        self._refresh_text_feature_data()
+        if not filepath.endswith(ARCHIVE_EXTENSION):
+            self.labelled = pd.read_csv(filepath)
+            self._append_rows(self.labelled[['text', 'class']])
+            return
+        archive = ColumnArchive(filepath)
+        signature = json.loads(json.dumps(self._feature_signature()))
+        reuse_features = all(meta.get('features') == signature for meta in archive.chunk_metadata())
+        columns = ['text', 'class'] + (self.feature_columns if reuse_features else [])
+        data = archive.read(columns)
+        self.labelled = pd.DataFrame({'text': data['text'], 'class': data['class']})
+        feature_data = pd.DataFrame({col: data[col] for col in self.feature_columns}) if reuse_features else None
+        rows = self._append_rows(self.labelled, feature_data)
+        self._archived_rows.setdefault(os.path.abspath(filepath), set()).update(rows.tolist())
 
     def add_unlabelled_examples(self, examples):
         """
@@ -337,10 +1450,11 @@ class BaseTextClassifier:
         Returns:
 
         """
-        new_examples = pd.DataFrame(data={'text': examples})
-        self.all_data = pd.concat([self.all_data, new_examples])
-        self.all_data.reset_index(inplace=True)
-        self._refresh_text_feature_data()
+        start = time.perf_counter()
+        examples = list(examples)
+        new_examples = pd.DataFrame(data={'text': self._filter_duplicates(examples)})
+        self._append_rows(new_examples)
+        self._record_ingestion(len(examples), len(new_examples), start)
 
 
 list_of_colors = "#e6194B, #3cb44b, #ffe119, #4363d8, #f58231, #911eb4, #42d4f4, #f032e6, #bfef45, #fabebe, #469990, #e6beff, #9A6324, #fffac8, #800000, #aaffc3, #808000, #ffd8b1, #000075, #a9a9a9"
@@ -348,21 +1462,23 @@ list_of_colors = list_of_colors.split(', ')
 
 
 class TextClassifier:
-    def __init__(self, dataset, unique_tags, data_directory=''):
+    def __init__(self, dataset, unique_tags, data_directory='', **kwargs):
         """
         Text Classifier from dataset and unique tags
         Args:
             dataset: list of strings
             unique_tags: list of tuples [(identifier, Readable Name)..]
             data_directory: Default data directory
+            kwargs: extra options passed on to BaseTextClassifier (e.g. query_batch_size=20)
         """
         self.unique_tags = unique_tags
-        self.tagger = BaseTextClassifier(dataset, data_directory=data_directory)
+        kwargs.setdefault('classes', [t[0] for t in unique_tags])
+        self.tagger = BaseTextClassifier(dataset, data_directory=data_directory, **kwargs)
         self.app = TextClassifier._get_app(self.tagger, self.unique_tags)
         self.utmapping = {t[0]: t[1] for t in self.unique_tags}
 
     @staticmethod
-    def _render_app_template(unique_tags_data):
+    def _render_app_template(unique_tags_data, url_prefix=''):
         """
         Tag data in the form
         [
@@ -370,6 +1486,7 @@ class TextClassifier:
         ]
         Args:
             unique_tags_data: list of tag tuples
+            url_prefix: path the app is mounted at, prepended to the urls of the requests made by the page
 
         Returns: html to render
 
@@ -387,44 +1504,67 @@ class TextClassifier:
         for index, item in enumerate(unique_tags_data):
             css_classes.append((item[0], list_of_colors[index]))
 
-        return template.render(css_classes=css_classes, id_color_map=css_classes, tag_controls=unique_tags_data)
+        return template.render(css_classes=css_classes, id_color_map=css_classes, tag_controls=unique_tags_data,
+                               url_prefix=url_prefix)
 
     @staticmethod
     def _get_app(tagger, tags):
         app = Flask(__name__)
+        # the tagger is not thread safe, requests are served one at a time
+        lock = threading.Lock()
 
         @app.route("/")
         def base_app():
-            return TextClassifier._render_app_template(tags)
+            return TextClassifier._render_app_template(tags, url_prefix=request.script_root)
 
         @app.route('/load_example')
         def load_example():
-            if tagger.model is None:
-                example = tagger.get_new_random_example()
-            else:
-                example = tagger.query_new_example(mode='entropy')
-
-            # print(f'Returning example ::: {example[:100]}')
-
-            return example
+            with lock:
+                if tagger.model is None:
+                    example = tagger.get_new_random_example()
+                else:
+                    example = tagger.get_next_queued_example(mode='entropy')
+                if example is None:
+                    return 'No example left to label', 404
+
+                # print(f'Returning example ::: {example[:100]}')
+
+                # every annotator saves the example it loaded, whichever example was loaded last
+                return example, {'X-Example-Id': str(tagger.current_example_index)}
+
+        @app.route('/load_batch')
+        def load_batch():
+            with lock:
+                if tagger.model is None:
+                    return json.dumps([])
+                size = int(request.args.get('size', tagger.query_batch_size))
+                texts = tagger.query_new_examples(size=size, mode='entropy')
+                # the ids are passed back to /save_example
+                return json.dumps([{'id': int(row), 'text': text} for row, text in zip(tagger.example_queue, texts)])
 
         @app.route('/update_model')
         def update_model():
-            tagger.update_model()
-            return "Model Updated Successfully"
+            with lock:
+                tagger.update_model()
+                return "Model Updated Successfully"
 
         @app.route('/save_example', methods=['POST'])
         def save_example():
-            form_data = request.form
-            tag = form_data['tag']
-            tagger.save_example(tag)
-            return 'Success'
+            with lock:
+                form_data = request.form
+                tag = form_data['tag']
+                if not form_data.get('id', '').isdigit():
+                    return 'Missing example id', 400
+                if not tagger.save_example(tag, example_id=int(form_data['id'])):
+                    return 'Unknown or already labelled example', 409
+                return 'Success'
 
         @app.route('/save_data')
         def save_tagged_data():
-            print("save_tagged_data")
-            tagger.save_data()
-            return 'Data Saved'
+            with lock:
+                print("save_tagged_data")
+                tagger.save_data()
+                return 'Data Saved'
 
         return app
 
@@ -477,7 +1617,7 @@ class TextClassifier:
 
     def save_model(self, model_filename):
         """
-        Save classifier model to file
+        Save classifier model to file, with the feature transformer it needs to classify new texts
         Args:
             model_filename: destination filename
 
@@ -485,27 +1625,62 @@ class TextClassifier:
 
         """
         with open(model_filename, 'wb') as out:
-            pickle.dump(self.tagger.model, out)
+            pickle.dump({'model': self.tagger.model, 'feature_transformer': self.tagger.feature_transformer}, out)
 
     def load_model(self, model_filename):
         """
-        Load classifier model from file
+        Load classifier model from file. The feature transformer saved with the model replaces the current
+        one if the model reads other features.
         Args:
             model_filename: source filename
 
         Returns:
 
         """
-        with open(model_filename, 'rb') as inp:
-            self.tagger.model = pickle.load(inp)
+        model, feature_transformer = load_text_model(model_filename)
+        if _model_feature_columns(model) != list(self.tagger.feature_columns):
+            self.tagger.set_feature_transformer(feature_transformer)
+        self.tagger.model = model
+        self.tagger._model_version += 1
+        self.tagger.attach_text_matrix()
 
     def update_model(self):
         """
         Updates the model
-        Returns:
+        Returns: dict with the statistics of this update
+
+        """
+        return self.tagger.update_model()
+
+    def dedup_stats(self):
+        """
+        Near duplicate collapsing statistics. See BaseTextClassifier.dedup_stats
+        Returns: dict of statistics
+
+        """
+        return self.tagger.dedup_stats()
+
+    def cluster_stats(self):
+        """
+        Cluster cold start statistics. See BaseTextClassifier.cluster_stats
+        Returns: dict of statistics
+
+        """
+        return self.tagger.cluster_stats()
+
+    def classify_texts(self, texts, batch_size=1000, n_jobs=1):
+        """
+        Lazily classifies texts with the trained model, in chunks of batch_size over n_jobs processes
+        Args:
+            texts: iterable of text strings
+            batch_size: number of texts featurized and scored at a time
+            n_jobs: number of worker processes (None uses all cores)
+
+        Returns: generator of (Readable class name, {Readable class name: probability}) tuples, in input order
 
         """
-        self.tagger.update_model()
+        for label, probabilities in self.tagger.classify_texts(texts, batch_size=batch_size, n_jobs=n_jobs):
+            yield self.utmapping.get(label, label), {self.utmapping.get(c, c): p for c, p in probabilities.items()}
 
 
 if __name__ == '__main__':
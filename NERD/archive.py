@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import io
+import json
+import os
+import zipfile
+
+import numpy as np
+
+# labelled data files with this extension are saved as a ColumnArchive
+ARCHIVE_EXTENSION = '.nerd'
+
+# string columns with at most this fraction of distinct values are dictionary encoded
+_DICTIONARY_RATIO = 0.5
+
+
+def _encode_strings(values):
+    """
+    Args:
+        values: list of strings (or None)
+
+    Returns: (int32 lengths in characters, -1 for missing values, UTF-8 bytes of the concatenated strings)
+
+    """
+    lengths = np.fromiter((-1 if value is None else len(value) for value in values), dtype=np.int32,
+                          count=len(values))
+    data = ''.join(value for value in values if value is not None).encode('utf-8', 'surrogatepass')
+    return lengths, data
+
+
+def _decode_strings(lengths, data):
+    text = data.decode('utf-8', 'surrogatepass')
+    ends = np.cumsum(np.maximum(lengths, 0)).tolist()
+    values = np.empty(len(lengths), dtype=object)
+    start = 0
+    for i, (length, end) in enumerate(zip(lengths.tolist(), ends)):
+        values[i] = None if length < 0 else text[start:end]
+        start = end
+    return values
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+# object columns of numbers or bools (e.g. integer class labels next to missing values) are stored as strings,
+# with their type in a type.txt member, and converted back on read
+_VALUE_TYPES = {'bool': lambda text: text == 'True', 'int': int, 'float': float}
+
+
+def _value_type(values):
+    """
+    Args:
+        values: list of values, without missing ones
+
+    Returns: str, bool, int or float, the type name of all the values
+
+    """
+    names = set()
+    for value in values:
+        if isinstance(value, str):
+            names.add('str')
+        elif isinstance(value, (bool, np.bool_)):
+            names.add('bool')
+        elif isinstance(value, (int, np.integer)):
+            names.add('int')
+        elif isinstance(value, (float, np.floating)):
+            names.add('float')
+        else:
+            raise ValueError(f'Cannot archive values of type {type(value).__name__}')
+    if len(names) > 1:
+        raise ValueError(f'Cannot archive a column mixing values of types {", ".join(sorted(names))}')
+    return names.pop() if names else 'str'
+
+
+class ColumnArchive:
+    """
+    Appendable, compressed columnar file. Every append adds a chunk of deflated members to a zip file,
+    named <chunk>/<column>/<member>, so nothing is rewritten and a reader only decompresses the columns
+    it asks for. Numeric and bool columns are stored as a values.npy array. Other columns are stored as
+    strings (lengths.npy + strings.utf8), or dictionary encoded (codes.npy + dict_lengths.npy + dict.utf8)
+    when they have few distinct values. Object columns may hold missing values and either strings or numbers
+    or bools of a single type, which are read back with their type.
+    """
+
+    def __init__(self, path, compresslevel=6):
+        """
+        Args:
+            path: archive file
+            compresslevel: zlib compression level of the members
+        """
+        self.path = path
+        self.compresslevel = compresslevel
+
+    def _layout(self):
+        """
+        Returns: dict of chunk -> dict of column -> set of member names
+
+        """
+        layout = {}
+        if not os.path.exists(self.path):
+            return layout
+        with zipfile.ZipFile(self.path) as archive:
+            for name in archive.namelist():
+                parts = name.split('/')
+                if len(parts) == 2:
+                    layout.setdefault(int(parts[0]), {})
+                elif len(parts) == 3:
+                    layout.setdefault(int(parts[0]), {}).setdefault(parts[1], set()).add(parts[2])
+        return layout
+
+    @property
+    def n_chunks(self):
+        return len(self._layout())
+
+    def columns(self):
+        """
+        Returns: sorted list of the column names of the archive
+
+        """
+        return sorted(set(column for chunk in self._layout().values() for column in chunk))
+
+    def chunk_metadata(self):
+        """
+        Returns: list of the metadata dicts given to append, one per chunk
+
+        """
+        if not os.path.exists(self.path):
+            return []
+        with zipfile.ZipFile(self.path) as archive:
+            return [json.loads(archive.read(f'{chunk:06d}/metadata.json')) for chunk in sorted(self._layout())]
+
+    @staticmethod
+    def _write_array(archive, name, array):
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        archive.writestr(name, buffer.getvalue())
+
+    @staticmethod
+    def _read_array(archive, name):
+        with archive.open(name) as inp:
+            return np.lib.format.read_array(inp, allow_pickle=False)
+
+    def append(self, data, metadata=None):
+        """
+        Appends a chunk. Columns may have different lengths (e.g. per sentence and per token columns).
+        Args:
+            data: dict of column name -> array like
+            metadata: JSON serializable dict stored with the chunk
+
+        Returns: number of the new chunk
+
+        """
+        # every column is checked before anything is written, so a rejected chunk leaves no members behind
+        columns = {}
+        for column, values in data.items():
+            if '/' in column or column == '':
+                raise ValueError(f'Invalid column name {column!r}')
+            values = np.asarray(values)
+            value_type = None
+            if values.dtype.kind not in 'biuf':
+                values = [None if _is_missing(value) else value for value in values.tolist()]
+                value_type = _value_type([value for value in values if value is not None])
+            columns[column] = (values, value_type)
+        chunk = self.n_chunks
+        with zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=self.compresslevel) as archive:
+            for column, (values, value_type) in columns.items():
+                prefix = f'{chunk:06d}/{column}/'
+                if value_type is None:
+                    ColumnArchive._write_array(archive, f'{prefix}values.npy', values)
+                    continue
+                if value_type != 'str':
+                    archive.writestr(f'{prefix}type.txt', value_type)
+                    values = [None if value is None else str(value) for value in values]
+                categories = {}
+                for value in values:
+                    if value is not None and value not in categories:
+                        categories[value] = len(categories)
+                if len(categories) <= _DICTIONARY_RATIO * len(values):
+                    codes = np.fromiter((-1 if value is None else categories[value] for value in values),
+                                        dtype=np.int32, count=len(values))
+                    lengths, encoded = _encode_strings(list(categories))
+                    ColumnArchive._write_array(archive, f'{prefix}codes.npy', codes)
+                    ColumnArchive._write_array(archive, f'{prefix}dict_lengths.npy', lengths)
+                    archive.writestr(f'{prefix}dict.utf8', encoded)
+                else:
+                    lengths, encoded = _encode_strings(values)
+                    ColumnArchive._write_array(archive, f'{prefix}lengths.npy', lengths)
+                    archive.writestr(f'{prefix}strings.utf8', encoded)
+            archive.writestr(f'{chunk:06d}/metadata.json', json.dumps(metadata or {}))
+        return chunk
+
+    @staticmethod
+    def _read_column(archive, chunk, column, members):
+        prefix = f'{chunk:06d}/{column}/'
+        if 'values.npy' in members:
+            return ColumnArchive._read_array(archive, f'{prefix}values.npy')
+        if 'codes.npy' in members:
+            codes = ColumnArchive._read_array(archive, f'{prefix}codes.npy')
+            categories = _decode_strings(ColumnArchive._read_array(archive, f'{prefix}dict_lengths.npy'),
+                                         archive.read(f'{prefix}dict.utf8'))
+            # the extra None category is the value of the missing (-1) codes
+            values = np.append(categories, None)
+        else:
+            codes = None
+            values = _decode_strings(ColumnArchive._read_array(archive, f'{prefix}lengths.npy'),
+                                     archive.read(f'{prefix}strings.utf8'))
+        if 'type.txt' in members:
+            convert = _VALUE_TYPES[archive.read(f'{prefix}type.txt').decode('ascii')]
+            for i, value in enumerate(values.tolist()):
+                if value is not None:
+                    values[i] = convert(value)
+        return values if codes is None else values[codes]
+
+    def read(self, columns=None):
+        """
+        Reads whole columns, concatenating the chunks
+        Args:
+            columns: column names (None for all)
+
+        Returns: dict of column name -> numpy array (object arrays of values/None for object columns)
+
+        """
+        layout = self._layout()
+        columns = self.columns() if columns is None else columns
+        parts = {column: [] for column in columns}
+        if len(layout) == 0:
+            return {column: np.array([], dtype=object) for column in columns}
+        with zipfile.ZipFile(self.path) as archive:
+            for chunk in sorted(layout):
+                for column in columns:
+                    members = layout[chunk].get(column)
+                    if members is None:
+                        raise KeyError(f'Column {column} is missing from chunk {chunk} of {self.path}')
+                    parts[column].append(ColumnArchive._read_column(archive, chunk, column, members))
+        return {column: np.concatenate(values) for column, values in parts.items()}
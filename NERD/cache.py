@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A bounded least recently used cache with hit/miss/eviction counters.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        """
+        Initialize an empty cache. Entries are evicted when either limit is exceeded.
+        Args:
+            max_entries: maximum number of entries (None for no limit)
+            max_bytes: maximum estimated size of the cached values (None for no limit)
+            sizeof: function estimating the size of a value in bytes. Required with max_bytes.
+        """
+        if max_bytes is not None and sizeof is None:
+            raise ValueError('sizeof is required when max_bytes is set')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value and marks it as recently used
+        Args:
+            key: cache key
+            default: returned on a miss
+
+        Returns: cached value or default
+
+        """
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """
+        Adds a value to the cache, evicting the least recently used entries if a limit is exceeded
+        Args:
+            key: cache key
+            value: value to cache
+
+        Returns:
+
+        """
+        self.pop(key)
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        self._data[key] = value
+        self._sizes[key] = size
+        self.bytes += size
+        while len(self._data) > 1 and self._over_limit():
+            old_key, _ = self._data.popitem(last=False)
+            self.bytes -= self._sizes.pop(old_key)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        Removes a value from the cache without counting an eviction
+        Args:
+            key: cache key
+            default: returned if the key is not cached
+
+        Returns: removed value or default
+
+        """
+        if key not in self._data:
+            return default
+        self.bytes -= self._sizes.pop(key)
+        return self._data.pop(key)
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def _over_limit(self):
+        if self.max_entries is not None and len(self._data) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            return True
+        return False
+
+    def stats(self):
+        """
+        Cache usage counters
+        Returns: dict with entries, bytes, hits, misses, hit_rate and evictions
+
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import pickle
+import sys
+import time
+from collections import deque
+
+from NERD.parallel import stream_tasks
+
+
+class _IdentityMapping(dict):
+    # tag identifiers without a readable name are reported as they are
+    def __missing__(self, key):
+        return key
+
+
+# model of a worker process, installed once per worker
+_worker_state = {}
+
+
+def _init_worker(task, model, utmapping, feature_transformer=None):
+    _worker_state['task'] = task
+    _worker_state['model'] = model
+    _worker_state['utmapping'] = utmapping
+    _worker_state['feature_transformer'] = feature_transformer
+
+
+def _annotate_chunk(texts):
+    """
+    Annotates a chunk of texts with the model of the worker
+    Args:
+        texts: list of text strings
+
+    Returns: list of result dicts, one per text
+        - ner: {'entities': [{'value': ..., 'entity': ...}, ...]}
+        - text: {'class': ..., 'probabilities': {class: probability}}
+
+    """
+    model = _worker_state['model']
+    utmapping = _worker_state['utmapping']
+    if _worker_state['task'] == 'ner':
+        from NERD.NER import BaseNerTagger, NerTagger
+        tagged = [BaseNerTagger._get_pos_tagged_example(text) for text in texts]
+        predictions = model.predict([BaseNerTagger._sent2features(example) for example in tagged])
+        return [{'entities': NerTagger._get_entities([tok[0] for tok in example], prediction, utmapping)}
+                for example, prediction in zip(tagged, predictions)]
+
+    from NERD.TEXT import _classify_chunk
+    classes, proba = _classify_chunk(model, _worker_state['feature_transformer'], texts)
+    names = [utmapping[c] for c in classes]
+    best = proba.argmax(axis=1)
+    return [{'class': names[best[i]], 'probabilities': dict(zip(names, row.tolist()))}
+            for i, row in enumerate(proba)]
+
+
+def _get_format(path, fmt):
+    if fmt is not None:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def _read_records(path, fmt, text_field):
+    """
+    Streams the input records
+    Args:
+        path: input file
+        fmt: jsonl (one JSON object or string per line) or csv (with a header)
+        text_field: field holding the text
+
+    Returns: generator of dicts
+
+    """
+    with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8') as inp:
+        if fmt == 'csv':
+            yield from csv.DictReader(inp)
+            return
+        for line in inp:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                record = {text_field: record}
+            yield record
+
+
+class _OutputWriter:
+    """
+    Appends annotated records to a JSONL or CSV file. CSV cells holding lists/dicts are JSON encoded.
+    """
+
+    def __init__(self, path, fmt, append):
+        self.fmt = fmt
+        self.out = open(path, 'a' if append else 'w', newline='' if fmt == 'csv' else None, encoding='utf-8')
+        self.csv_writer = None
+        # a resumed CSV output already has its header
+        self.write_header = not append or self.out.tell() == 0
+
+    def write(self, records):
+        for record in records:
+            if self.fmt == 'jsonl':
+                self.out.write(json.dumps(record) + '\n')
+                continue
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(self.out, fieldnames=list(record.keys()), extrasaction='ignore')
+                if self.write_header:
+                    self.csv_writer.writeheader()
+            self.csv_writer.writerow({k: json.dumps(v) if isinstance(v, (list, dict)) else v
+                                      for k, v in record.items()})
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        return self.out.tell()
+
+    def close(self):
+        self.out.close()
+
+
+def _load_checkpoint(path, input_path, chunk_size):
+    if not os.path.exists(path):
+        return None
+    with open(path) as inp:
+        checkpoint = json.load(inp)
+    if checkpoint.get('input') != os.path.abspath(input_path) or checkpoint.get('chunk_size') != chunk_size:
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(path, checkpoint):
+    # write and rename, so a crash never leaves a truncated checkpoint
+    with open(path + '.tmp', 'w') as out:
+        json.dump(checkpoint, out)
+    os.replace(path + '.tmp', path)
+
+
+def annotate_file(task, model_path, input_path, output_path, text_field='text', tags=None, input_format=None,
+                  output_format=None, chunk_size=1000, n_jobs=1, resume=False, progress=True):
+    """
+    Annotates every record of an input file with a saved model and writes the records, with the
+    annotations added, to the output file. The input is streamed in chunks over a pool of worker
+    processes. A checkpoint is written after every chunk, so an interrupted run can be resumed.
+    Args:
+        task: ner (model saved by NerTagger.save_model) or text (model saved by TextClassifier.save_model)
+        model_path: pickled model
+        input_path: JSONL or CSV input file
+        output_path: JSONL or CSV output file
+        text_field: field of the input records holding the text
+        tags: dict of tag/class identifier -> Readable Name (None reports the identifiers)
+        input_format: jsonl or csv (None guesses from the file extension)
+        output_format: jsonl or csv (None guesses from the file extension)
+        chunk_size: number of records per chunk
+        n_jobs: number of worker processes (None uses all cores)
+        resume: continue after the last completed chunk of a previous run with the same input and chunk size
+        progress: report the progress and throughput on stderr
+
+    Returns: dict with the number of records and chunks, elapsed seconds and records per second
+
+    """
+    input_format = _get_format(input_path, input_format)
+    output_format = _get_format(output_path, output_format)
+    if task == 'text':
+        from NERD.TEXT import load_text_model
+        # the features are calculated by the feature transformer the model was saved with
+        model, feature_transformer = load_text_model(model_path)
+    else:
+        with open(model_path, 'rb') as inp:
+            model = pickle.load(inp)
+        feature_transformer = None
+    utmapping = _IdentityMapping(tags or {})
+
+    checkpoint_path = output_path + '.progress'
+    checkpoint = _load_checkpoint(checkpoint_path, input_path, chunk_size) if resume else None
+    if checkpoint is not None and os.path.exists(output_path):
+        # drop whatever was written after the last completed chunk
+        with open(output_path, 'r+b') as out:
+            out.truncate(checkpoint['output_bytes'])
+    else:
+        checkpoint = {'input': os.path.abspath(input_path), 'chunk_size': chunk_size, 'chunks': 0, 'records': 0,
+                      'output_bytes': 0, 'done': False}
+    if checkpoint['done']:
+        return {'records': checkpoint['records'], 'chunks': checkpoint['chunks'], 'seconds': 0.0,
+                'records_per_second': 0.0}
+
+    records = itertools.islice(_read_records(input_path, input_format, text_field), checkpoint['records'], None)
+    pending = deque()
+
+    def chunks():
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if len(chunk) == 0:
+                return
+            pending.append(chunk)
+            yield ([str(record.get(text_field) or '') for record in chunk],)
+
+    writer = _OutputWriter(output_path, output_format, append=checkpoint['records'] > 0)
+    start = time.perf_counter()
+    n_records = 0
+    try:
+        for results in stream_tasks(_annotate_chunk, chunks(), n_jobs=n_jobs, initializer=_init_worker,
+                                    initargs=(task, model, utmapping, feature_transformer)):
+            chunk = pending.popleft()
+            checkpoint['output_bytes'] = writer.write([dict(record, **result) for record, result in zip(chunk, results)])
+            checkpoint['chunks'] += 1
+            checkpoint['records'] += len(chunk)
+            n_records += len(chunk)
+            _save_checkpoint(checkpoint_path, checkpoint)
+            if progress:
+                elapsed = time.perf_counter() - start
+                print(f'{checkpoint["records"]} records ({checkpoint["chunks"]} chunks) done, '
+                      f'{n_records / elapsed:.1f} records/s', file=sys.stderr)
+    finally:
+        writer.close()
+    checkpoint['done'] = True
+    _save_checkpoint(checkpoint_path, checkpoint)
+    elapsed = time.perf_counter() - start
+    return {
+        'records': checkpoint['records'],
+        'chunks': checkpoint['chunks'],
+        'seconds': elapsed,
+        'records_per_second': n_records / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def _load_tags(path):
+    # either {"identifier": "Readable Name"} or [["identifier", "Readable Name"], ...] as in unique_tags
+    if path is None:
+        return None
+    with open(path) as inp:
+        tags = json.load(inp)
+    return dict(tags) if isinstance(tags, list) else tags
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nerd-annotate',
+                                     description='Annotate a JSONL/CSV file with a saved NERD model.')
+    parser.add_argument('task', choices=['ner', 'text'], help='type of the saved model')
+    parser.add_argument('model', help='model file saved by NerTagger/TextClassifier.save_model')
+    parser.add_argument('input', help='input JSONL or CSV file')
+    parser.add_argument('output', help='output JSONL or CSV file')
+    parser.add_argument('--text-field', default='text', help='field holding the text (default: text)')
+    parser.add_argument('--tags', help='JSON file mapping tag/class identifiers to readable names')
+    parser.add_argument('--input-format', choices=['jsonl', 'csv'], help='default: guessed from the extension')
+    parser.add_argument('--output-format', choices=['jsonl', 'csv'], help='default: guessed from the extension')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='records per chunk (default: 1000)')
+    parser.add_argument('--n-jobs', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--resume', action='store_true', help='continue after the last completed chunk')
+    parser.add_argument('--quiet', action='store_true', help='do not report the progress')
+    args = parser.parse_args(argv)
+
+    stats = annotate_file(args.task, args.model, args.input, args.output, text_field=args.text_field,
+                          tags=_load_tags(args.tags), input_format=args.input_format,
+                          output_format=args.output_format, chunk_size=args.chunk_size, n_jobs=args.n_jobs,
+                          resume=args.resume, progress=not args.quiet)
+    if not args.quiet:
+        print(f'{stats["records"]} records annotated in {stats["seconds"]:.1f}s '
+              f'({stats["records_per_second"]:.1f} records/s)', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
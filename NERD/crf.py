@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import copy
+import struct
+
+import numpy as np
+
+# crfsuite model files (CRF1d, written by crfsuite's crf1dm writer) are a header followed by 4 byte aligned
+# chunks: the features, two constant hash databases (CQDB) of the label and attribute names, the label
+# references (transition features of each label) and the attribute references (state features of each
+# attribute). The pruning below rewrites the features, the attribute names and both reference chunks.
+_HEADER = struct.Struct('<4sI4sIIIIIIIII')
+_CHUNK_HEADER = struct.Struct('<4sII')
+_CQDB_HEADER = struct.Struct('<4sIIIII')
+_CQDB_TABLES = 256
+_CQDB_BYTEORDER = 0x62445371
+_FEATURE_DTYPE = np.dtype([('type', '<u4'), ('src', '<u4'), ('dst', '<u4'), ('weight', '<f8')])
+_STATE_FEATURE = 0
+
+
+def _pad(data):
+    return data + b'\0' * (-len(data) % 4)
+
+
+def _read_cqdb(chunk):
+    """
+    Args:
+        chunk: bytes of a CQDB chunk
+
+    Returns: list of (key with its trailing NUL, hash of the key), ordered by id
+
+    """
+    _, _, _, _, n_keys, backward_offset = _CQDB_HEADER.unpack_from(chunk)
+    tables = np.frombuffer(chunk, dtype='<u4', count=2 * _CQDB_TABLES, offset=_CQDB_HEADER.size).reshape(-1, 2)
+    hashes = {}
+    for offset, n_buckets in tables.tolist():
+        if n_buckets > 0:
+            buckets = np.frombuffer(chunk, dtype='<u4', count=2 * n_buckets, offset=offset).reshape(-1, 2)
+            hashes.update(zip(buckets[:, 1].tolist(), buckets[:, 0].tolist()))
+    records = []
+    for offset in np.frombuffer(chunk, dtype='<u4', count=n_keys, offset=backward_offset).tolist():
+        size = struct.unpack_from('<I', chunk, offset + 4)[0]
+        records.append((chunk[offset + 8:offset + 8 + size], hashes[offset]))
+    return records
+
+
+def _write_cqdb(records):
+    """
+    Args:
+        records: list of (key with its trailing NUL, hash of the key), the ids are the positions
+
+    Returns: bytes of the CQDB chunk
+
+    """
+    data_offset = _CQDB_HEADER.size + 8 * _CQDB_TABLES
+    data = bytearray()
+    tables = [[] for _ in range(_CQDB_TABLES)]
+    backward = []
+    for i, (key, key_hash) in enumerate(records):
+        offset = data_offset + len(data)
+        tables[key_hash % _CQDB_TABLES].append((key_hash, offset))
+        backward.append(offset)
+        data += struct.pack('<II', i, len(key)) + key
+    table_refs = []
+    for entries in tables:
+        # open addressing with linear probing, in tables twice as large as their number of keys
+        n_buckets = 2 * len(entries)
+        if n_buckets == 0:
+            table_refs.append((0, 0))
+            continue
+        buckets = [(0, 0)] * n_buckets
+        for key_hash, offset in entries:
+            k = (key_hash >> 8) % n_buckets
+            while buckets[k][1] != 0:
+                k = (k + 1) % n_buckets
+            buckets[k] = (key_hash, offset)
+        table_refs.append((data_offset + len(data), n_buckets))
+        data += np.array(buckets, dtype='<u4').tobytes()
+    backward_offset = data_offset + len(data)
+    data += np.array(backward, dtype='<u4').tobytes()
+    header = _CQDB_HEADER.pack(b'CQDB', data_offset + len(data), 0, _CQDB_BYTEORDER, len(records), backward_offset)
+    return header + np.array(table_refs, dtype='<u4').tobytes() + bytes(data)
+
+
+def _read_refs(data, offset):
+    """
+    Returns: list of feature id arrays, None for the entries without a list
+
+    """
+    _, _, n_entries = _CHUNK_HEADER.unpack_from(data, offset)
+    refs = []
+    for entry in np.frombuffer(data, dtype='<u4', count=n_entries, offset=offset + _CHUNK_HEADER.size).tolist():
+        if entry == 0:
+            refs.append(None)
+            continue
+        count = struct.unpack_from('<I', data, entry)[0]
+        refs.append(np.frombuffer(data, dtype='<u4', count=count, offset=entry + 4))
+    return refs
+
+
+def _write_refs(chunk_id, refs, start):
+    """
+    Args:
+        chunk_id: LFRF or AFRF
+        refs: list of feature id arrays (None for the entries without a list)
+        start: file offset of the chunk, the entry offsets are absolute
+
+    Returns: bytes of the chunk
+
+    """
+    body_offset = start + _CHUNK_HEADER.size + 4 * len(refs)
+    entries, body = [], bytearray()
+    for fids in refs:
+        if fids is None:
+            entries.append(0)
+            continue
+        entries.append(body_offset + len(body))
+        body += struct.pack('<I', len(fids)) + np.asarray(fids, dtype='<u4').tobytes()
+    return (_CHUNK_HEADER.pack(chunk_id, body_offset - start + len(body), len(refs))
+            + np.array(entries, dtype='<u4').tobytes() + bytes(body))
+
+
+def prune_model_data(data, min_weight):
+    """
+    Drops the state features with an absolute weight below min_weight from a crfsuite model file, and the
+    attributes left without features. Transition features are kept.
+    Args:
+        data: bytes of the model file
+        min_weight: weight threshold
+
+    Returns: bytes of the pruned model file
+
+    """
+    (magic, _, model_type, version, n_features_field, n_labels, n_attributes, features_offset, labels_offset,
+     attributes_offset, label_refs_offset, attribute_refs_offset) = _HEADER.unpack_from(data)
+    if magic != b'lCRF' or model_type != b'FOMC':
+        raise ValueError('Not a crfsuite CRF1d model')
+    n_features = _CHUNK_HEADER.unpack_from(data, features_offset)[2]
+    features = np.frombuffer(data, dtype=_FEATURE_DTYPE, count=n_features,
+                             offset=features_offset + _CHUNK_HEADER.size)
+    is_state = features['type'] == _STATE_FEATURE
+    keep = ~is_state | (np.abs(features['weight']) >= min_weight)
+    new_fids = np.cumsum(keep) - 1
+
+    kept_attributes = np.unique(features['src'][keep & is_state])
+    new_attributes = np.full(n_attributes, -1, dtype=np.int64)
+    new_attributes[kept_attributes] = np.arange(len(kept_attributes))
+    kept_features = features[keep].copy()
+    kept_is_state = kept_features['type'] == _STATE_FEATURE
+    kept_features['src'][kept_is_state] = new_attributes[kept_features['src'][kept_is_state]]
+
+    attribute_names = _read_cqdb(data[attributes_offset:label_refs_offset])
+    attribute_refs = _read_refs(data, attribute_refs_offset)
+    label_refs = [fids if fids is None else new_fids[fids[keep[fids]]]
+                  for fids in _read_refs(data, label_refs_offset)]
+
+    chunks = [
+        _CHUNK_HEADER.pack(b'FEAT', _CHUNK_HEADER.size + kept_features.nbytes, len(kept_features))
+        + kept_features.tobytes(),
+        # the label names are unchanged
+        data[labels_offset:attributes_offset],
+        _write_cqdb([attribute_names[a] for a in kept_attributes.tolist()]),
+    ]
+    chunks = [_pad(chunk) for chunk in chunks]
+    offsets = [_HEADER.size]
+    for chunk in chunks:
+        offsets.append(offsets[-1] + len(chunk))
+    chunks.append(_pad(_write_refs(b'LFRF', label_refs, offsets[-1])))
+    offsets.append(offsets[-1] + len(chunks[-1]))
+    chunks.append(_pad(_write_refs(b'AFRF', [new_fids[attribute_refs[a][keep[attribute_refs[a]]]]
+                                             for a in kept_attributes.tolist()], offsets[-1])))
+    size = offsets[-1] + len(chunks[-1])
+    header = _HEADER.pack(magic, size, model_type, version, n_features_field, n_labels, len(kept_attributes),
+                          *offsets)
+    return header + b''.join(chunks)
+
+
+def prune_crf(crf, min_weight=0.2):
+    """
+    Copy of a trained CRF without the state features whose absolute weight is below min_weight. Most state
+    features of a CRF trained with L1 regularization are rare word features with small weights, so the
+    copy is smaller and faster to load and decode, and predicts almost the same tags. It is a regular
+    sklearn_crfsuite.CRF, decoded by crfsuite.
+    Args:
+        crf: fitted sklearn_crfsuite.CRF
+        min_weight: state features with an absolute weight below this are dropped
+
+    Returns: sklearn_crfsuite.CRF
+
+    """
+    with open(crf.modelfile.name, 'rb') as inp:
+        data = inp.read()
+    pruned = copy.copy(crf)
+    # a new temporary model file, owned by the copy
+    pruned.modelfile = type(crf.modelfile)()
+    pruned.modelfile.ensure_name()
+    with open(pruned.modelfile.name, 'wb') as out:
+        out.write(prune_model_data(data, min_weight))
+    pruned._tagger = None
+    pruned._info_cached = None
+    return pruned
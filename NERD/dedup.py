@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import re
+import time
+import zlib
+
+import numpy as np
+
+_word_re = re.compile(r'\w+')
+
+# MinHash permutations are universal hashes (a * x + b) mod a mersenne prime
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+
+class NearDuplicateIndex:
+    """
+    Groups near duplicate texts with MinHash signatures over token shingles and LSH banding.
+    Only the first text of every group (its representative) is indexed, later texts are either
+    new representatives or duplicates of an existing one.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, shingle_size=3, seed=1):
+        """
+        Args:
+            threshold: minimum estimated Jaccard similarity of the shingle sets of two near duplicates
+            num_perm: number of MinHash permutations
+            bands: number of LSH bands, num_perm must be a multiple of it. More bands find less similar
+                candidates at a higher cost.
+            shingle_size: number of consecutive (lower cased) tokens per shingle
+            seed: seed of the permutations
+        """
+        if num_perm % bands != 0:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=(num_perm, 1)).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=(num_perm, 1)).astype(np.uint64)
+        # (band, band signature bytes) -> keys of the representatives
+        self._buckets = {}
+        self._signatures = {}
+        self.n_added = 0
+        self.n_duplicates = 0
+        self.seconds = 0.0
+
+    def _shingles(self, text):
+        tokens = _word_re.findall(text.lower())
+        n = self.shingle_size
+        if len(tokens) <= n:
+            return [' '.join(tokens)]
+        return [' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+    def signature(self, text):
+        """
+        Args:
+            text: text string
+
+        Returns: MinHash signature (uint64 array of num_perm values)
+
+        """
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in set(self._shingles(text))), dtype=np.uint64)
+        return ((self._a * hashes[None, :] + self._b) % _MERSENNE_PRIME).min(axis=1)
+
+    def _band_keys(self, signature):
+        rows = self.num_perm // self.bands
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def add(self, key, text):
+        """
+        Adds a text to the index
+        Args:
+            key: identifier of the text, kept if it becomes a representative
+            text: text string
+
+        Returns: key of the representative the text duplicates, or None if it is a new representative
+
+        """
+        start = time.perf_counter()
+        signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        representative = None
+        seen = set()
+        for band_key in band_keys:
+            for candidate in self._buckets.get(band_key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    representative = candidate
+                    break
+            if representative is not None:
+                break
+
+        self.n_added += 1
+        if representative is None:
+            self._signatures[key] = signature
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, []).append(key)
+        else:
+            self.n_duplicates += 1
+        self.seconds += time.perf_counter() - start
+        return representative
+
+    def stats(self):
+        """
+        Returns: dict with the number of added texts, representatives and duplicates, the fraction of texts
+            collapsed (shrinkage) and the indexing throughput
+
+        """
+        return {
+            'texts': self.n_added,
+            'representatives': len(self._signatures),
+            'duplicates': self.n_duplicates,
+            'shrinkage': self.n_duplicates / self.n_added if self.n_added > 0 else 0.0,
+            'texts_per_second': self.n_added / self.seconds if self.seconds > 0 else 0.0,
+        }
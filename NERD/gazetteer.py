@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from collections import deque
+
+
+class GazetteerMatcher:
+    """
+    Multi-pattern matcher over tokens (Aho-Corasick automaton) for dictionaries of known entities.
+    Matching is linear in the number of tokens regardless of the dictionary size.
+    """
+
+    def __init__(self, gazetteers, tokenizer=None, lowercase=True):
+        """
+        Compile the gazetteers into an automaton.
+        Args:
+            gazetteers: dict of tag -> iterable of phrases. A phrase is a string or a list of tokens.
+            tokenizer: function splitting a phrase string into tokens. Defaults to str.split.
+            lowercase: match case insensitively
+        """
+        self.tokenizer = tokenizer if tokenizer is not None else str.split
+        self.lowercase = lowercase
+        # goto transitions, failure links and the longest pattern (length, tag) ending at each node
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self._longest = [None]
+        self.n_patterns = 0
+        for tag, phrases in gazetteers.items():
+            for phrase in phrases:
+                self._add(phrase, tag)
+        self._build()
+
+    def _normalize(self, token):
+        return token.lower() if self.lowercase else token
+
+    def _add(self, phrase, tag):
+        tokens = self.tokenizer(phrase) if isinstance(phrase, str) else phrase
+        if len(tokens) == 0:
+            return
+        node = 0
+        for token in tokens:
+            token = self._normalize(token)
+            nxt = self._goto[node].get(token)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][token] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._longest.append(None)
+            node = nxt
+        if self._output[node] is None:
+            self.n_patterns += 1
+        self._output[node] = (len(tokens), tag)
+
+    def _build(self):
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            self._longest[nxt] = self._output[nxt]
+            queue.append(nxt)
+        while queue:
+            node = queue.popleft()
+            for token, nxt in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(token, 0)
+                if fail == nxt:
+                    fail = 0
+                self._fail[nxt] = fail
+                # the node's own pattern is the longest one ending here, else the longest proper suffix
+                self._longest[nxt] = self._output[nxt] if self._output[nxt] is not None else self._longest[fail]
+                queue.append(nxt)
+
+    def find(self, tokens):
+        """
+        Finds non overlapping gazetteer matches, preferring longer matches over the ones they contain.
+        Args:
+            tokens: list of tokens
+
+        Returns: list of (start, end, tag) tuples, end exclusive
+
+        """
+        selected = []
+        node = 0
+        for j, token in enumerate(tokens):
+            token = self._normalize(token)
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            match = self._longest[node]
+            if match is None:
+                continue
+            length, tag = match
+            start = j - length + 1
+            # drop earlier matches contained in this one
+            while selected and selected[-1][0] >= start:
+                selected.pop()
+            if selected and selected[-1][1] > start:
+                continue
+            selected.append((start, j + 1, tag))
+        return selected
+
+    @staticmethod
+    def to_bilou(matches, length):
+        """
+        Converts matches to BILOU tags
+        Args:
+            matches: list of (start, end, tag) tuples
+            length: number of tokens
+
+        Returns: list of BILOU tags
+
+        """
+        tags = ['O'] * length
+        for start, end, tag in matches:
+            if end - start == 1:
+                tags[start] = f'U-{tag}'
+            else:
+                tags[start] = f'B-{tag}'
+                for i in range(start + 1, end - 1):
+                    tags[i] = f'I-{tag}'
+                tags[end - 1] = f'L-{tag}'
+        return tags
+
+    def tag(self, tokens):
+        """
+        Pre-tags tokens with the gazetteer matches
+        Args:
+            tokens: list of tokens
+
+        Returns: list of BILOU tags
+
+        """
+        return GazetteerMatcher.to_bilou(self.find(tokens), len(tokens))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Load test of the annotation servers with simulated annotators.
+
+    python -m NERD.loadtest ner --annotators 8 --duration 60
+    python -m NERD.loadtest text --annotators 16 --corpus-size 50000 --update-every 20
+
+The app of NerTagger._get_app or TextClassifier._get_app is served locally on a synthetic corpus and every
+annotator repeatedly loads an example, tags it, saves it (by the id /load_example returned) and, every few
+saves, updates the model. Latency percentiles and throughput are reported per endpoint. Failed requests are
+errors, and so are saves that were acknowledged but whose example did not end up labelled.
+"""
+
+import argparse
+import json
+import logging
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+import numpy as np
+from werkzeug.serving import make_server
+
+COURSE_WORDS = ['introduction', 'to', 'machine', 'learning', 'data', 'structures', 'algorithms', 'systems',
+                'taught', 'by', 'in', 'the', 'fall', 'spring', 'semester', 'credits', 'course', 'covers']
+PROFESSORS = ['Smith', 'Jones', 'Brown', 'Taylor', 'Wilson', 'Davies']
+STREETS = ['Park', 'High', 'Main', 'Church', 'Station', 'Mill']
+CITIES = ['London', 'Leeds', 'Boston', 'Paris', 'Berlin']
+
+NER_TAGS = [('CC', 'Course Code'), ('PROF', 'Professor'), ('SE', 'Season')]
+TEXT_TAGS = [('Address', 'Address'), ('Other', 'Non Address')]
+
+
+def make_ner_corpus(size, seed=0):
+    """
+    Synthetic course descriptions with course codes, professors and seasons
+    Args:
+        size: number of texts
+        seed: random seed
+
+    Returns: list of strings
+
+    """
+    rnd = random.Random(seed)
+    texts = []
+    for _ in range(size):
+        words = [rnd.choice(COURSE_WORDS) for _ in range(rnd.randint(8, 25))]
+        words.insert(rnd.randint(0, len(words)), f'CS{rnd.randint(100, 999)}')
+        if rnd.random() < 0.5:
+            words.insert(rnd.randint(0, len(words)), f'Prof {rnd.choice(PROFESSORS)}')
+        texts.append(' '.join(words))
+    return texts
+
+
+def make_text_corpus(size, seed=0):
+    """
+    Synthetic mix of addresses and other short texts
+    Args:
+        size: number of texts
+        seed: random seed
+
+    Returns: list of strings
+
+    """
+    rnd = random.Random(seed)
+    texts = []
+    for _ in range(size):
+        if rnd.random() < 0.5:
+            texts.append(f'{rnd.randint(1, 500)} {rnd.choice(STREETS)} Road {rnd.choice(CITIES)}')
+        else:
+            texts.append(' '.join(rnd.choice(COURSE_WORDS) for _ in range(rnd.randint(3, 12))))
+    return texts
+
+
+def _tag_ner_html(html):
+    # simulated annotator: tags course codes, the name following "Prof" and seasons
+    from bs4 import BeautifulSoup
+    from NERD.NER import NerTagger
+    tokens = [span.text for span in BeautifulSoup(html, 'html.parser').find_all('span')]
+    tagged = []
+    for i, token in enumerate(tokens):
+        if token.startswith('CS') and token[2:].isdigit():
+            tag = 'U-CC'
+        elif i > 0 and tokens[i - 1] == 'Prof':
+            tag = 'U-PROF'
+        elif token in ('fall', 'spring'):
+            tag = 'U-SE'
+        else:
+            tag = 'O'
+        tagged.append((token, '', tag))
+    return NerTagger._generate_html_from_example(tagged)
+
+
+def _text_tag(text):
+    # simulated annotator: addresses start with a house number
+    return 'Address' if text[:1].isdigit() else 'Other'
+
+
+def _build_app(task, corpus_size, data_directory, seed, **kwargs):
+    if task == 'ner':
+        from NERD.NER import BaseNerTagger, NerTagger
+        tagger = BaseNerTagger(make_ner_corpus(corpus_size, seed), data_directory=data_directory, **kwargs)
+        return tagger, NerTagger._get_app(tagger, NER_TAGS)
+    from NERD.TEXT import BaseTextClassifier, TextClassifier
+    tagger = BaseTextClassifier(make_text_corpus(corpus_size, seed), data_directory=data_directory, **kwargs)
+    return tagger, TextClassifier._get_app(tagger, TEXT_TAGS)
+
+
+def _labelled_ids(task, tagger):
+    if task == 'ner':
+        return set(example.get('id') for example in tagger.labelled)
+    return set(tagger.labelled_rows)
+
+
+class _Annotator(threading.Thread):
+    """
+    Loads, tags and saves examples until the deadline, updating the model every update_every saves
+    """
+
+    def __init__(self, task, base_url, deadline, update_every, think_time, seed, record, saved):
+        super().__init__(daemon=True)
+        self.task = task
+        self.base_url = base_url
+        self.deadline = deadline
+        self.update_every = update_every
+        self.think_time = think_time
+        self.rnd = random.Random(seed)
+        self.record = record
+        # ids of the examples whose save was acknowledged
+        self.saved = saved
+
+    def _request(self, endpoint, data=None):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+        start = time.perf_counter()
+        try:
+            # error statuses (e.g. a save the tagger rejected) raise HTTPError
+            with urllib.request.urlopen(self.base_url + endpoint, data=body, timeout=600) as response:
+                text = response.read().decode('utf-8')
+                example_id = response.headers.get('X-Example-Id')
+            ok = True
+        except Exception:
+            text = example_id = None
+            ok = False
+        self.record(endpoint, time.perf_counter() - start, ok)
+        return text, example_id
+
+    def run(self):
+        saves = 0
+        while time.monotonic() < self.deadline:
+            example, example_id = self._request('/load_example')
+            if example is None:
+                continue
+            if self.think_time > 0:
+                time.sleep(self.rnd.uniform(0, 2 * self.think_time))
+            if self.task == 'ner':
+                data = {'html': _tag_ner_html(example), 'id': example_id}
+            else:
+                data = {'tag': _text_tag(example), 'id': example_id}
+            if self._request('/save_example', data)[0] is not None:
+                self.saved.append(int(example_id))
+            saves += 1
+            if self.update_every and saves % self.update_every == 0:
+                self._request('/update_model')
+
+
+def run_load_test(task='ner', annotators=4, duration=30.0, corpus_size=5000, update_every=10, think_time=0.0,
+                  seed=0, data_directory=None, tagger_kwargs=None):
+    """
+    Serves a tagging app on a synthetic corpus and drives it with simulated annotators
+    Args:
+        task: ner or text
+        annotators: number of concurrent annotators
+        duration: seconds the annotators keep working
+        corpus_size: number of unlabelled texts
+        update_every: each annotator calls /update_model after this many saves (0 never updates)
+        think_time: mean seconds an annotator spends tagging an example
+        seed: random seed of the corpus and the annotators
+        data_directory: data directory of the tagger (a temporary directory by default)
+        tagger_kwargs: extra options of BaseNerTagger/BaseTextClassifier
+
+    Returns: dict of endpoint -> {'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput'}. The errors of
+        /save_example include the acknowledged saves whose example is not labelled at the end of the test.
+
+    """
+    if data_directory is None:
+        data_directory = tempfile.mkdtemp()
+    tagger, app = _build_app(task, corpus_size, data_directory, seed, **(tagger_kwargs or {}))
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    saved = []
+
+    def record(endpoint, seconds, ok):
+        with lock:
+            latencies[endpoint].append(seconds)
+            if not ok:
+                errors[endpoint] += 1
+
+    start = time.monotonic()
+    deadline = start + duration
+    threads = [_Annotator(task, base_url, deadline, update_every, think_time, seed + i + 1, record, saved)
+               for i in range(annotators)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    server.shutdown()
+    # a save is lost if the example it was acknowledged for is not labelled, or was saved twice
+    labelled = _labelled_ids(task, tagger)
+    errors['/save_example'] += len(saved) - len(set(saved) & labelled)
+
+    report = {}
+    for endpoint, values in sorted(latencies.items()):
+        values = np.array(values) * 1000
+        report[endpoint] = {
+            'requests': len(values),
+            'errors': errors[endpoint],
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99)),
+            'throughput': len(values) / elapsed,
+        }
+    return report
+
+
+def format_report(report):
+    lines = [f'{"endpoint":<16}{"requests":>10}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}']
+    for endpoint, stats in report.items():
+        lines.append(f'{endpoint:<16}{stats["requests"]:>10}{stats["errors"]:>8}{stats["p50_ms"]:>10.1f}'
+                     f'{stats["p95_ms"]:>10.1f}{stats["p99_ms"]:>10.1f}{stats["throughput"]:>10.2f}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test a NERD tagging server with simulated annotators.')
+    parser.add_argument('task', choices=['ner', 'text'])
+    parser.add_argument('--annotators', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds (default: 30)')
+    parser.add_argument('--corpus-size', type=int, default=5000)
+    parser.add_argument('--update-every', type=int, default=10, help='saves per annotator between model updates')
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean seconds spent tagging an example')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+    # one log line per request would flood the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    report = run_load_test(args.task, annotators=args.annotators, duration=args.duration,
+                           corpus_size=args.corpus_size, update_every=args.update_every, think_time=args.think_time,
+                           seed=args.seed)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import functools
+import os
+import pickle
+import tempfile
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# path of the state file whose initializer last ran in this worker
+_installed_state = {'path': None}
+
+
+def run_tasks(fn, tasks, n_jobs=None, executor=None):
+    """
+    Runs fn over a list of argument tuples and returns the results in order.
+    Args:
+        fn: module level (picklable) function
+        tasks: list of argument tuples
+        n_jobs: number of worker processes. 1 runs everything in the current process,
+            None uses all cores.
+        executor: an existing executor to submit to instead of creating a new pool
+
+    Returns: list of results, one per task
+
+    """
+    tasks = list(tasks)
+    if executor is not None:
+        futures = [executor.submit(fn, *args) for args in tasks]
+        return [f.result() for f in futures]
+    if n_jobs == 1 or len(tasks) <= 1:
+        return [fn(*args) for args in tasks]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(fn, *args) for args in tasks]
+        return [f.result() for f in futures]
+
+
+def _run_initialized(state_path, fn, *args):
+    # a shared executor runs the tasks of many streams, so the state of this stream is installed on the first
+    # of its tasks a worker gets, and again whenever a task of another stream ran in between
+    if _installed_state['path'] != state_path:
+        with open(state_path, 'rb') as inp:
+            initializer, initargs = pickle.load(inp)
+        initializer(*initargs)
+        _installed_state['path'] = state_path
+    return fn(*args)
+
+
+def _submit_bounded(pool, fn, tasks, max_pending):
+    pending = deque()
+    try:
+        for args in tasks:
+            pending.append(pool.submit(fn, *args))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def stream_tasks(fn, tasks, n_jobs=None, initializer=None, initargs=(), max_pending=None, executor=None):
+    """
+    Lazily runs fn over an iterable of argument tuples and yields the results in order, keeping at
+    most max_pending tasks in flight so arbitrarily long inputs run in bounded memory.
+    Args:
+        fn: module level (picklable) function
+        tasks: iterable of argument tuples
+        n_jobs: number of worker processes. 1 runs everything in the current process,
+            None uses all cores.
+        initializer: function called once per worker (or once in the current process with n_jobs=1),
+            e.g. to install state shared by every task
+        initargs: arguments of the initializer
+        max_pending: maximum number of submitted tasks without a yielded result. Defaults to twice the
+            number of workers.
+        executor: an existing process pool to submit to instead of creating a new one. The initializer and
+            its arguments are then pickled once to a temporary file, which each worker loads on its first task.
+
+    Returns: generator of results, one per task
+
+    """
+    if n_jobs == 1 and executor is None:
+        if initializer is not None:
+            initializer(*initargs)
+        for args in tasks:
+            yield fn(*args)
+        return
+    if max_pending is None:
+        max_pending = 2 * (n_jobs if n_jobs is not None else os.cpu_count() or 1)
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=initializer, initargs=initargs) as pool:
+            yield from _submit_bounded(pool, fn, tasks, max_pending)
+        return
+    if initializer is None:
+        yield from _submit_bounded(executor, fn, tasks, max_pending)
+        return
+    # a unique name, so a worker never mistakes the state of a later stream for one it already installed
+    state_path = os.path.join(tempfile.gettempdir(), f'nerd_worker_state_{uuid.uuid4().hex}.pickle')
+    with open(state_path, 'wb') as out:
+        pickle.dump((initializer, initargs), out, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        yield from _submit_bounded(executor, functools.partial(_run_initialized, state_path, fn), tasks,
+                                   max_pending)
+    finally:
+        os.remove(state_path)
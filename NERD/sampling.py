@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import heapq
+import random
+import time
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import HashingVectorizer
+
+
+class ClusterSampler:
+    """
+    Representative sampling index of an unlabelled pool. The texts are clustered once, with mini-batch
+    k-means over hashed bag-of-words vectors, and examples are drawn cluster by cluster: a cluster is
+    chosen with a probability growing with its number of unlabelled members and shrinking with the number
+    of examples already drawn from it, then its member closest to the centroid is returned.
+    Texts added after the clustering are assigned to the nearest existing centroid.
+    """
+
+    def __init__(self, n_clusters=50, n_features=2 ** 12, batch_size=1024, chunk_size=10000, density_weight=1.0,
+                 seed=0):
+        """
+        Args:
+            n_clusters: number of clusters (at most the number of texts of the first batch)
+            n_features: dimension of the hashed bag-of-words vectors
+            batch_size: mini-batch size of k-means
+            chunk_size: number of texts vectorized and assigned at a time
+            density_weight: exponent of the cluster size in the cluster weights. 0 picks clusters uniformly,
+                1 proportionally to their number of unlabelled members.
+            seed: random seed of the clustering
+        """
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.density_weight = density_weight
+        self.seed = seed
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm='l2',
+                                            lowercase=True)
+        self.kmeans = None
+        # key -> cluster of every text ever added
+        self.clusters = {}
+        # per cluster heap of (distance to the centroid, key), entries of keys no longer available are
+        # skipped when popped
+        self._heaps = []
+        self._available = []
+        self._picks = []
+        # keys that can still be sampled
+        self._members = set()
+        self.fit_seconds = 0.0
+
+    @property
+    def fitted(self):
+        return self.kmeans is not None
+
+    def _assign(self, texts):
+        """
+        Args:
+            texts: list of strings
+
+        Returns: (clusters, distances to the cluster centroids) arrays
+
+        """
+        clusters, distances = [], []
+        for start in range(0, len(texts), self.chunk_size):
+            distance_matrix = self.kmeans.transform(self.vectorizer.transform(texts[start:start + self.chunk_size]))
+            best = distance_matrix.argmin(axis=1)
+            clusters.append(best)
+            distances.append(distance_matrix[np.arange(len(best)), best])
+        return np.concatenate(clusters), np.concatenate(distances)
+
+    def _fit(self, texts):
+        start = time.perf_counter()
+        n_clusters = min(self.n_clusters, len(texts))
+        self.kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=self.batch_size, n_init=3,
+                                      random_state=self.seed)
+        self.kmeans.fit(self.vectorizer.transform(texts))
+        self._heaps = [[] for _ in range(n_clusters)]
+        self._available = [0] * n_clusters
+        self._picks = [0] * n_clusters
+        self.fit_seconds = time.perf_counter() - start
+
+    def add(self, keys, texts):
+        """
+        Indexes unlabelled texts. The first non empty batch is clustered, later ones are assigned to the
+        nearest centroid.
+        Args:
+            keys: list of hashable identifiers, one per text
+            texts: list of strings
+
+        Returns:
+
+        """
+        texts = list(texts)
+        if len(texts) == 0:
+            return
+        if not self.fitted:
+            self._fit(texts)
+        clusters, distances = self._assign(texts)
+        for key, cluster, distance in zip(keys, clusters.tolist(), distances.tolist()):
+            if key in self._members:
+                continue
+            self.clusters[key] = cluster
+            self._members.add(key)
+            heapq.heappush(self._heaps[cluster], (distance, key))
+            self._available[cluster] += 1
+
+    def discard(self, key):
+        """
+        Removes a key (e.g. once labelled) from the keys that can be sampled
+        Args:
+            key: identifier
+
+        Returns:
+
+        """
+        if key not in self._members:
+            return
+        self._members.remove(key)
+        self._available[self.clusters[key]] -= 1
+
+    def cluster_of(self, key):
+        """
+        Args:
+            key: identifier
+
+        Returns: cluster of the key, None if it was never added
+
+        """
+        return self.clusters.get(key)
+
+    def __len__(self):
+        return len(self._members)
+
+    def _pop(self, cluster):
+        heap = self._heaps[cluster]
+        while len(heap) > 0:
+            _, key = heapq.heappop(heap)
+            if key not in self._members:
+                continue
+            self._members.remove(key)
+            self._available[cluster] -= 1
+            self._picks[cluster] += 1
+            return key
+        return None
+
+    def sample(self):
+        """
+        Draws the next representative example. It is no longer available afterwards.
+        Returns: key, or None if no key is available
+
+        """
+        weights = [available ** self.density_weight / (1 + picks) if available > 0 else 0.0
+                   for available, picks in zip(self._available, self._picks)]
+        total = sum(weights)
+        if total <= 0:
+            return None
+        cluster = random.choices(range(len(weights)), weights=weights)[0]
+        return self._pop(cluster)
+
+    def stats(self):
+        """
+        Returns: dict with the number of clusters, indexed and available keys, smallest/largest cluster,
+            number of clusters sampled from and the clustering time
+
+        """
+        sizes = np.bincount(list(self.clusters.values()), minlength=len(self._heaps)) if self.fitted else []
+        return {
+            'clusters': len(self._heaps),
+            'indexed': len(self.clusters),
+            'available': len(self),
+            'min_cluster_size': int(min(sizes)) if len(sizes) > 0 else 0,
+            'max_cluster_size': int(max(sizes)) if len(sizes) > 0 else 0,
+            'clusters_sampled': sum(1 for picks in self._picks if picks > 0),
+            'fit_seconds': self.fit_seconds,
+        }
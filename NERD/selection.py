@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy as np
+
+
+def jaccard_similarity(a, b):
+    """
+    Jaccard similarity of two sets
+    Args:
+        a: set
+        b: set
+
+    Returns: similarity in [0, 1]
+
+    """
+    if len(a) == 0 and len(b) == 0:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def select_diverse(scores, token_sets, size, diversity=0.5, clusters=None, cluster_similarity=0.5):
+    """
+    Greedily selects a batch of high scoring and mutually dissimilar examples.
+    At every step the candidate maximizing score * (1 - diversity * max similarity to the
+    already selected examples) is picked.
+    Args:
+        scores: list/array of informativeness scores (higher is better)
+        token_sets: list of token sets, one per candidate, used for the token overlap similarity
+        size: number of examples to select
+        diversity: weight of the redundancy penalty in [0, 1]. 0 returns the top-k by score.
+        clusters: optional list of cluster ids, one per candidate (None for unknown). Two candidates of the
+            same cluster are at least cluster_similarity similar.
+        cluster_similarity: similarity floor of candidates sharing a cluster
+
+    Returns: list of selected candidate positions, in selection order
+
+    """
+    scores = np.asarray(scores, dtype=float)
+    size = min(size, len(scores))
+    if diversity <= 0:
+        return [int(i) for i in np.argsort(-scores, kind='stable')[:size]]
+
+    max_similarity = np.zeros(len(scores))
+    available = np.ones(len(scores), dtype=bool)
+    selected = []
+    for _ in range(size):
+        adjusted = np.where(available, scores * (1 - diversity * max_similarity), -np.inf)
+        best = int(np.argmax(adjusted))
+        selected.append(best)
+        available[best] = False
+        for i in np.flatnonzero(available):
+            sim = jaccard_similarity(token_sets[best], token_sets[i])
+            if clusters is not None and clusters[best] is not None and clusters[best] == clusters[i]:
+                sim = max(sim, cluster_similarity)
+            if sim > max_similarity[i]:
+                max_similarity[i] = sim
+    return selected
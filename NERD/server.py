@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from nltk import pos_tag, word_tokenize
+
+from NERD.NER import BaseNerTagger, NerTagger
+from NERD.TEXT import BaseTextClassifier, TextClassifier
+
+PROJECT_KINDS = ('ner', 'text')
+
+
+class _Project:
+    def __init__(self, name, kind, dataset, unique_tags, data_directory, kwargs):
+        self.name = name
+        self.kind = kind
+        self.dataset = dataset
+        self.unique_tags = unique_tags
+        self.data_directory = data_directory
+        self.kwargs = kwargs
+        self.tagger = None
+        self.app = None
+        self.last_used = time.monotonic()
+        self.active_requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def state_path(self):
+        return os.path.join(self.data_directory, 'project_state.pickle')
+
+
+class ProjectServer:
+    """
+    A single WSGI server hosting many NER and text classification projects, each mounted at /<project name>/.
+    Projects are loaded on their first request and unloaded (pickled to their data directory) after being
+    idle for a while. All the projects share the process wide NLTK tokenizer/tagger and one worker pool, used
+    for model fitting, NER cross validation and text scoring. Each worker loads a scoring model once per pass.
+    """
+
+    def __init__(self, data_directory='', idle_timeout=1800, check_interval=60, n_jobs=None):
+        """
+        Args:
+            data_directory: each project keeps its data in data_directory/<project name>
+            idle_timeout: seconds without requests after which a project is unloaded (None never unloads)
+            check_interval: seconds between two checks for idle projects
+            n_jobs: number of processes of the shared worker pool (None uses all cores)
+        """
+        self.data_directory = data_directory
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.n_jobs = n_jobs
+        self.projects = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.n_jobs)
+            return self._executor
+
+    def add_project(self, name, kind, dataset, unique_tags, **kwargs):
+        """
+        Registers a project. Nothing is loaded until its first request.
+        Args:
+            name: project name, used as its URL prefix
+            kind: ner or text
+            dataset: list of strings, or a function returning it (called on the first load only)
+            unique_tags: list of ('TagID', 'Tag Name') tuples
+            kwargs: extra options passed on to BaseNerTagger/BaseTextClassifier
+
+        Returns:
+
+        """
+        if kind not in PROJECT_KINDS:
+            raise ValueError(f'Unknown project kind {kind}')
+        if '/' in name or name == '':
+            raise ValueError(f'Invalid project name {name!r}')
+        if name in self.projects:
+            raise ValueError(f'Project {name} already exists')
+        self.projects[name] = _Project(name, kind, dataset, unique_tags, os.path.join(self.data_directory, name),
+                                       kwargs)
+
+    def add_ner_project(self, name, dataset, unique_tags, **kwargs):
+        self.add_project(name, 'ner', dataset, unique_tags, **kwargs)
+
+    def add_text_project(self, name, dataset, unique_tags, **kwargs):
+        self.add_project(name, 'text', dataset, unique_tags, **kwargs)
+
+    def _build_tagger(self, project):
+        dataset = project.dataset() if callable(project.dataset) else project.dataset
+        if project.kind == 'ner':
+            return BaseNerTagger(dataset, data_directory=project.data_directory, **project.kwargs)
+        kwargs = dict(project.kwargs)
+        kwargs.setdefault('classes', [t[0] for t in project.unique_tags])
+        return BaseTextClassifier(dataset, data_directory=project.data_directory, **kwargs)
+
+    def _load(self, project):
+        if os.path.exists(project.state_path):
+            with open(project.state_path, 'rb') as inp:
+                tagger = pickle.load(inp)
+        else:
+            os.makedirs(project.data_directory, exist_ok=True)
+            tagger = self._build_tagger(project)
+            # the state file replaces the dataset from now on
+            project.dataset = None
+        tagger.executor = self.executor
+        if project.kind == 'ner':
+            project.app = NerTagger._get_app(tagger, project.unique_tags)
+        else:
+            tagger.attach_text_matrix()
+            project.app = TextClassifier._get_app(tagger, project.unique_tags)
+        project.tagger = tagger
+
+    def _unload(self, project):
+        tagger = project.tagger
+        # the pool belongs to the server
+        tagger.executor = None
+        tmp_path = project.state_path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            pickle.dump(tagger, out)
+        os.replace(tmp_path, project.state_path)
+        project.tagger = None
+        project.app = None
+
+    def get_tagger(self, name):
+        """
+        Returns the BaseNerTagger/BaseTextClassifier of a project, loading it if needed
+        Args:
+            name: project name
+
+        Returns: tagger
+
+        """
+        project = self.projects[name]
+        with project.lock:
+            if project.tagger is None:
+                self._load(project)
+            project.last_used = time.monotonic()
+            return project.tagger
+
+    def unload_idle(self, idle_timeout=None):
+        """
+        Unloads the loaded projects without requests for idle_timeout seconds
+        Args:
+            idle_timeout: defaults to the idle_timeout of the server
+
+        Returns: list of the unloaded project names
+
+        """
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        unloaded = []
+        now = time.monotonic()
+        for project in list(self.projects.values()):
+            with project.lock:
+                if project.tagger is None or project.active_requests > 0:
+                    continue
+                if now - project.last_used >= idle_timeout:
+                    self._unload(project)
+                    unloaded.append(project.name)
+        return unloaded
+
+    def status(self):
+        """
+        Returns: dict of project name -> {'kind', 'loaded', 'idle_seconds'}
+
+        """
+        now = time.monotonic()
+        return {name: {'kind': project.kind, 'loaded': project.tagger is not None,
+                       'idle_seconds': now - project.last_used}
+                for name, project in self.projects.items()}
+
+    def _monitor_idle(self):
+        while not self._stop.wait(self.check_interval):
+            self.unload_idle()
+
+    @staticmethod
+    def _respond(start_response, status, body, content_type='application/json'):
+        body = body.encode('utf-8')
+        start_response(status, [('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return [body]
+
+    def __call__(self, environ, start_response):
+        # dispatch on the first path segment, the project app sees the rest of the path
+        path = environ.get('PATH_INFO', '') or '/'
+        name, _, rest = path.lstrip('/').partition('/')
+        if name == '':
+            return ProjectServer._respond(start_response, '200 OK', json.dumps(self.status()))
+        project = self.projects.get(name)
+        if project is None:
+            return ProjectServer._respond(start_response, '404 NOT FOUND', json.dumps({'error': 'Unknown project'}))
+
+        with project.lock:
+            if project.tagger is None:
+                self._load(project)
+            project.active_requests += 1
+            app = project.app
+        try:
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/' + name
+            environ['PATH_INFO'] = '/' + rest
+            # the project app consumes the request here, the response body is a short string
+            return list(app(environ, start_response))
+        finally:
+            with project.lock:
+                project.active_requests -= 1
+                project.last_used = time.monotonic()
+
+    def start_server(self, port=None, host='localhost'):
+        """
+        Starts the server, with a background thread unloading idle projects
+        Args:
+            port: Port number to bind the server to.
+            host: interface to bind the server to
+
+        Returns:
+
+        """
+        from werkzeug.serving import run_simple
+
+        # load the NLTK tokenizer/tagger once, before the first request
+        pos_tag(word_tokenize('NERD'))
+        if self.idle_timeout is not None and self._monitor is None:
+            self._monitor = threading.Thread(target=self._monitor_idle, daemon=True)
+            self._monitor.start()
+        try:
+            run_simple(host, port if port else 5050, self, threaded=True)
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Unloads every project (so their state is saved) and shuts the worker pool down
+        Returns:
+
+        """
+        self._stop.set()
+        self.unload_idle(idle_timeout=0)
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
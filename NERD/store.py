@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import random
+
+import numpy as np
+import pandas as pd
+
+
+class IndexSet:
+    """
+    Set of row ids with O(1) add, discard, membership and uniform random choice.
+    """
+
+    def __init__(self, items=()):
+        self._items = []
+        self._positions = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def add(self, item):
+        item = int(item)
+        if item not in self._positions:
+            self._positions[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item):
+        position = self._positions.pop(int(item), None)
+        if position is None:
+            return
+        last = self._items.pop()
+        if position < len(self._items):
+            # move the last item into the freed slot
+            self._items[position] = last
+            self._positions[last] = position
+
+    def sample(self, n=None):
+        """
+        Args:
+            n: number of distinct items to draw (None draws a single item)
+
+        Returns: a uniformly chosen item, or a list of min(n, len) distinct items
+
+        """
+        if n is not None:
+            return random.sample(self._items, min(n, len(self._items)))
+        return self._items[random.randint(0, len(self._items) - 1)]
+
+    def to_array(self):
+        return np.array(self._items, dtype=np.int64)
+
+
+class _Column:
+    """
+    Column stored as a list of fixed size numpy chunks. Appending fills the last chunk and allocates
+    new ones, existing chunks are never copied.
+    """
+
+    def __init__(self, dtype, chunk_size, fill_value):
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.fill_value = fill_value
+        self.chunks = []
+        self.length = 0
+
+    def _reserve(self, length):
+        while len(self.chunks) * self.chunk_size < length:
+            self.chunks.append(np.full(self.chunk_size, self.fill_value, dtype=self.dtype))
+
+    def _encode(self, values):
+        return np.asarray(values, dtype=self.dtype)
+
+    def extend(self, values):
+        values = self._encode(values)
+        start = self.length
+        self._reserve(start + len(values))
+        written = 0
+        while written < len(values):
+            chunk, offset = divmod(start + written, self.chunk_size)
+            n = min(self.chunk_size - offset, len(values) - written)
+            self.chunks[chunk][offset:offset + n] = values[written:written + n]
+            written += n
+        self.length += len(values)
+
+    def pad(self, length):
+        # rows appended without a value for this column keep the fill value
+        self._reserve(length)
+        self.length = length
+
+    def take(self, rows=None):
+        if rows is None:
+            if len(self.chunks) == 0:
+                return np.empty(0, dtype=self.dtype)
+            return np.concatenate(self.chunks)[:self.length]
+        rows = np.asarray(rows, dtype=np.int64)
+        chunk_ids, offsets = np.divmod(rows, self.chunk_size)
+        out = np.empty(len(rows), dtype=self.dtype)
+        for chunk in np.unique(chunk_ids):
+            mask = chunk_ids == chunk
+            out[mask] = self.chunks[chunk][offsets[mask]]
+        return out
+
+    def get(self, row):
+        chunk, offset = divmod(int(row), self.chunk_size)
+        return self.chunks[chunk][offset]
+
+    def set(self, row, value):
+        chunk, offset = divmod(int(row), self.chunk_size)
+        self.chunks[chunk][offset] = self._encode([value])[0]
+
+    def decode(self, values):
+        return values
+
+    def nbytes(self):
+        return sum(chunk.nbytes for chunk in self.chunks)
+
+
+class _CategoricalColumn(_Column):
+    """
+    Column of int32 category codes, -1 for missing values.
+    """
+
+    def __init__(self, chunk_size):
+        super().__init__(np.int32, chunk_size, -1)
+        self.categories = []
+        self._codes = {}
+
+    def _encode(self, values):
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                codes[i] = -1
+                continue
+            code = self._codes.get(value)
+            if code is None:
+                code = len(self.categories)
+                self._codes[value] = code
+                self.categories.append(value)
+            codes[i] = code
+        return codes
+
+    def get(self, row):
+        code = super().get(row)
+        return self.categories[code] if code >= 0 else None
+
+    def decode(self, values):
+        return pd.Categorical.from_codes(values, categories=pd.Index(self.categories, dtype=object))
+
+
+class ColumnStore:
+    """
+    Append only columnar table. Integer columns are stored as int32 when their values fit, float columns as
+    float64 (or float32 on request), categorical columns as integer codes and everything else as object arrays.
+    """
+
+    def __init__(self, chunk_size=2 ** 14, float32=False):
+        """
+        Args:
+            chunk_size: number of rows per allocated chunk
+            float32: store the float columns as float32, which halves their memory but keeps only about 7
+                significant digits
+        """
+        self.chunk_size = chunk_size
+        self.float32 = float32
+        self._columns = {}
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    def _new_column(self, values):
+        if isinstance(values, pd.Series):
+            values = values.values
+        if isinstance(values, pd.Categorical) or isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+            return _CategoricalColumn(self.chunk_size), np.asarray(values, dtype=object)
+        values = np.asarray(values)
+        if values.dtype.kind == 'b':
+            return _Column(np.bool_, self.chunk_size, False), values
+        if values.dtype.kind in 'iu':
+            small = len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max)
+            return _Column(np.int32 if small else np.int64, self.chunk_size, 0), values
+        if values.dtype.kind == 'f':
+            return _Column(np.float32 if self.float32 else np.float64, self.chunk_size, np.nan), values
+        return _Column(object, self.chunk_size, None), values.astype(object)
+
+    def set_column(self, name, values):
+        """
+        Creates (or replaces) a whole column
+        Args:
+            name: column name
+            values: array like, one value per row
+
+        Returns:
+
+        """
+        if len(values) != self.length:
+            raise ValueError(f'Column {name} has {len(values)} values for {self.length} rows')
+        column, values = self._new_column(values)
+        column.extend(values)
+        self._columns[name] = column
+
+    def drop_columns(self, names):
+        for name in names:
+            self._columns.pop(name, None)
+
+    def append(self, data):
+        """
+        Appends rows. Columns missing from data are filled with missing values, unknown columns are created.
+        Args:
+            data: dict of column name -> array like, all of the same length
+
+        Returns: array of the new row ids
+
+        """
+        lengths = set(len(values) for values in data.values())
+        if len(lengths) > 1:
+            raise ValueError('All the columns must have the same length')
+        n = lengths.pop() if lengths else 0
+        for name, values in data.items():
+            if name not in self._columns:
+                column, values = self._new_column(values)
+                column.pad(self.length)
+                self._columns[name] = column
+            else:
+                if isinstance(values, pd.Series):
+                    values = values.values
+                if isinstance(self._columns[name], _CategoricalColumn):
+                    values = np.asarray(values, dtype=object)
+            self._columns[name].extend(values)
+        start = self.length
+        self.length += n
+        for column in self._columns.values():
+            if column.length < self.length:
+                column.pad(self.length)
+        return np.arange(start, self.length, dtype=np.int64)
+
+    def get_column(self, name, rows=None):
+        """
+        Args:
+            name: column name
+            rows: row ids (None for all the rows)
+
+        Returns: numpy array, or pandas Categorical for categorical columns
+
+        """
+        column = self._columns[name]
+        return column.decode(column.take(rows))
+
+    def get_value(self, name, row):
+        return self._columns[name].get(row)
+
+    def set_value(self, name, row, value):
+        self._columns[name].set(row, value)
+
+    def row(self, row, columns=None):
+        """
+        Args:
+            row: row id
+            columns: columns to return (None for all)
+
+        Returns: dict of column name -> value
+
+        """
+        columns = self.columns if columns is None else columns
+        return {name: self.get_value(name, row) for name in columns}
+
+    def frame(self, rows=None, columns=None):
+        """
+        Builds a DataFrame of some rows and columns, indexed by row id
+        Args:
+            rows: row ids (None for all the rows)
+            columns: column names (None for all)
+
+        Returns: DataFrame
+
+        """
+        columns = self.columns if columns is None else columns
+        index = pd.RangeIndex(self.length) if rows is None else pd.Index(np.asarray(rows, dtype=np.int64))
+        return pd.DataFrame({name: self.get_column(name, rows) for name in columns}, index=index)
+
+    def memory_usage(self):
+        """
+        Returns: dict of column name -> allocated bytes (object columns count the pointers only)
+
+        """
+        return {name: column.nbytes() for name, column in self._columns.items()}
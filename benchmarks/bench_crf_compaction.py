@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark of pruned CRFs (NERD.crf.prune_crf) against the sklearn_crfsuite model they are pruned from.
+
+    python benchmarks/bench_crf_compaction.py --train 2000 --test 1000 --vocabulary 20000
+
+A CRF is trained on synthetic tagged sentences with a large vocabulary, so most of its state features
+are rare word features. For each pruning threshold the pickled size, load time, decoding time and
+held-out token accuracy of both models are reported.
+"""
+
+import argparse
+import pickle
+import random
+import time
+
+from NERD.NER import BaseNerTagger, DEFAULT_CRF_PARAMS
+from NERD.crf import prune_crf
+
+POS = ['NN', 'NNP', 'VB', 'JJ', 'IN', 'DT', 'CD']
+SEASONS = ['Fall', 'Spring', 'Summer', 'Winter']
+
+
+def make_sentences(n, vocabulary, seed=0):
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(3, 9)))
+             for _ in range(vocabulary)]
+    # names are only recognizable by memorizing them, which keeps many word features in the model
+    names = set(rnd.sample(words, vocabulary // 10))
+    sentences = []
+    for _ in range(n):
+        sentence = []
+        for _ in range(rnd.randint(8, 25)):
+            word = rnd.choice(words)
+            sentence.append((word, rnd.choice(POS), 'U-PROF' if word in names else 'O'))
+        sentence.insert(rnd.randint(0, len(sentence)), (f'CS{rnd.randint(100, 999)}', 'NNP', 'U-CC'))
+        if rnd.random() < 0.5:
+            i = rnd.randint(0, len(sentence))
+            sentence[i:i] = [(rnd.choice(SEASONS), 'NNP', 'B-SE'), (str(rnd.randint(2000, 2030)), 'CD', 'L-SE')]
+        sentences.append(sentence)
+    return sentences
+
+
+def token_accuracy(model, X, Y):
+    correct = total = 0
+    for xseq, yseq in zip(X, Y):
+        correct += sum(1 for p, y in zip(model.predict_single(xseq), yseq) if p == y)
+        total += len(yseq)
+    return correct / total
+
+
+def measure(model, X, Y):
+    data = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+    start = time.perf_counter()
+    pickle.loads(data)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    accuracy = token_accuracy(model, X, Y)
+    predict_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    model.predict_marginals(X)
+    marginals_seconds = time.perf_counter() - start
+    return len(data), load_seconds, predict_seconds, marginals_seconds, accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--train', type=int, default=2000)
+    parser.add_argument('--test', type=int, default=1000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--min-weights', type=float, nargs='+', default=[0.05, 0.1, 0.2, 0.5])
+    args = parser.parse_args()
+
+    sentences = make_sentences(args.train + args.test, args.vocabulary)
+    X = [BaseNerTagger._sent2features(s) for s in sentences]
+    Y = [BaseNerTagger._sent2labels(s) for s in sentences]
+    model = BaseNerTagger._build_crf(DEFAULT_CRF_PARAMS)
+    start = time.perf_counter()
+    model.fit(X[:args.train], Y[:args.train])
+    print(f'trained on {args.train} sentences in {time.perf_counter() - start:.1f}s, '
+          f'{len(model.state_features_)} state features')
+    test_X, test_Y = X[args.train:], Y[args.train:]
+
+    print(f'{"model":<16}{"features":>10}{"KB":>10}{"load ms":>10}{"predict s":>11}{"marginals s":>13}'
+          f'{"accuracy":>10}')
+
+    def report(name, features, size, load_seconds, predict_seconds, marginals_seconds, accuracy):
+        print(f'{name:<16}{features:>10}{size / 1024:>10.1f}{load_seconds * 1000:>10.2f}{predict_seconds:>11.3f}'
+              f'{marginals_seconds:>13.3f}{accuracy:>10.4f}')
+
+    report('crf', len(model.state_features_), *measure(model, test_X, test_Y))
+    for min_weight in args.min_weights:
+        pruned = prune_crf(model, min_weight=min_weight)
+        report(f'pruned {min_weight:g}', len(pruned.state_features_), *measure(pruned, test_X, test_Y))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark of the compressed columnar labelled data archive (.nerd) against the CSV (text classification)
+and pickle (NER) files written by save_data.
+
+    python benchmarks/bench_labelled_archive.py --text-rows 100000 --ner-examples 20000
+
+Text rows are generated longer than the POS tagging cutoff, so loading the CSV only recomputes the
+hand crafted features. The archive stores the features and reloads them instead.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from NERD.NER import BaseNerTagger
+from NERD.TEXT import BaseTextClassifier
+
+WORDS = ['Course', 'CS101', 'introduction', 'to', 'Machine', 'Learning', 'PROF', 'Smith', '4', 'credits',
+         'Fall', '2019', '(lab)', 'Pre-requisites:', 'MATH', '201;', 'and', 'the', 'data', 'ALGORITHMS']
+POS = ['NN', 'NNP', 'VB', 'JJ', 'IN', 'DT', 'CD']
+TAGS = ['O', 'O', 'O', 'O', 'U-CC', 'B-PROF', 'L-PROF', 'U-SE']
+
+
+def make_texts(rows, seed=0):
+    rnd = random.Random(seed)
+    texts = []
+    while len(texts) < rows:
+        text = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(20, 40)))
+        if len(text) >= 100:
+            texts.append(text)
+    return texts
+
+
+def make_ner_examples(n, seed=0):
+    rnd = random.Random(seed)
+    return [{'id': i, 'raw': [(rnd.choice(WORDS), rnd.choice(POS), rnd.choice(TAGS))
+                              for _ in range(rnd.randint(8, 30))]}
+            for i in range(n)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def report(name, path, seconds):
+    print(f'{name:<24}{os.path.getsize(path) / 2 ** 20:>10.2f}{seconds:>10.2f}')
+
+
+def bench_text(rows, directory):
+    texts = make_texts(rows)
+    rnd = random.Random(1)
+    tagger = BaseTextClassifier(texts[:10], data_directory=directory)
+    tagger._append_rows(pd.DataFrame({'text': texts, 'class': [rnd.choice(['A', 'B']) for _ in texts]}))
+    for name in ['text.csv', 'text.nerd']:
+        path = os.path.join(directory, name)
+        save_seconds = timed(lambda: tagger.save_data(path))
+        report(f'save {name}', path, save_seconds)
+        loader = BaseTextClassifier(texts[:10], data_directory=directory)
+        report(f'load {name}', path, timed(lambda: loader.load_data(path)))
+
+
+def bench_ner(n, directory):
+    examples = make_ner_examples(n)
+    # labelled examples carry their features, which the pickle stores too
+    for example in examples:
+        example['features'] = BaseNerTagger._sent2features(example['raw'])
+    tagger = BaseNerTagger(None, labelled=examples, data_directory=directory)
+    for name in ['ner.pickle', 'ner.nerd']:
+        path = os.path.join(directory, name)
+        report(f'save {name}', path, timed(lambda: tagger.save_data(path)))
+        loader = BaseNerTagger(None, data_directory=directory)
+        report(f'load {name}', path, timed(lambda: loader.load_data(path)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--text-rows', type=int, default=100000)
+    parser.add_argument('--ner-examples', type=int, default=20000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    print(f'{"":<24}{"MB":>10}{"seconds":>10}')
+    bench_text(args.text_rows, directory)
+    bench_ner(args.ner_examples, directory)
+
+
+if __name__ == '__main__':
+    main()
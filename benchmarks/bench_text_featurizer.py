@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark of DefaultTextFeaturizer.transform against the previous multi-pass implementation.
+
+    python benchmarks/bench_text_featurizer.py --rows 100000
+
+Texts are generated longer than the POS tagging cutoff so both versions only compute the
+hand crafted features. The outputs are checked to be identical.
+"""
+
+import argparse
+import random
+import re
+import time
+
+import pandas as pd
+
+from NERD.TEXT import DefaultTextFeaturizer
+
+WORDS = ['Course', 'CS101', 'introduction', 'to', 'Machine', 'Learning', 'PROF', 'Smith', '4', 'credits',
+         'Fall', '2019', '(lab)', 'Pre-requisites:', 'MATH', '201;', 'and', 'the', 'data', 'ALGORITHMS']
+
+
+def legacy_transform(X):
+    data = pd.DataFrame(data={'text': X})
+    data.text = data.text.apply(lambda x: DefaultTextFeaturizer._cleanup_string(x))
+    data["pos_string"] = data.text.apply(lambda x: DefaultTextFeaturizer._get_pos_string(x))
+    data['text_feature_text_length'] = data['text'].apply(lambda x: len(x))
+    data['text_feature_capitals'] = data['text'].apply(lambda comment: sum(1 for c in comment if c.isupper()))
+    data['text_feature_digits'] = data['text'].apply(lambda comment: sum(1 for c in comment if c.isdigit()))
+    data['text_feature_caps_vs_length'] = data.apply(
+        lambda row: row['text_feature_capitals'] / (row['text_feature_text_length'] + 0.001), axis=1)
+    data['text_feature_num_symbols'] = data['text'].apply(lambda comment: len(re.findall(r'\W', comment)))
+    data['text_feature_num_words'] = data['text'].apply(lambda comment: len(comment.split()))
+    data['text_feature_num_unique_words'] = data['text'].apply(lambda comment: len(set(w for w in comment.split())))
+    data['text_feature_words_vs_unique'] = data['text_feature_num_unique_words'] / (
+            data['text_feature_num_words'] + 0.001)
+
+    data['text_feature_first_token'] = data['text'].apply(
+        lambda x: DefaultTextFeaturizer._is_alpha_and_numeric(DefaultTextFeaturizer._get_nth_token(x, 0)))
+    data['text_feature_second_token'] = data['text'].apply(
+        lambda x: DefaultTextFeaturizer._is_alpha_and_numeric(DefaultTextFeaturizer._get_nth_token(x, 1)))
+    data['text_feature_third_token'] = data['text'].apply(
+        lambda x: DefaultTextFeaturizer._is_alpha_and_numeric(DefaultTextFeaturizer._get_nth_token(x, 2)))
+
+    data['text_feature_title_word_count'] = data['text'].apply(lambda x: sum(1 for c in x.split() if c.istitle()))
+    data['text_feature_title_word_total_word_ratio'] = data['text_feature_title_word_count'] / (
+            data['text_feature_num_words'] + 0.001)
+    data['text_feature_numeric_tokens'] = data['text'].apply(lambda x: sum(1 for c in x.split() if c.isdigit()))
+    data['text_feature_capital_tokens'] = data['text'].apply(lambda x: sum(1 for c in x.split() if c.isupper()))
+
+    return data.drop(columns=['text'])
+
+
+def make_texts(rows, seed=0):
+    rnd = random.Random(seed)
+    texts = []
+    while len(texts) < rows:
+        text = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(20, 40)))
+        if len(text) >= 100:
+            texts.append(text)
+    return pd.Series(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    texts = make_texts(args.rows)
+
+    start = time.perf_counter()
+    expected = legacy_transform(texts)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = DefaultTextFeaturizer().transform(texts)
+    seconds = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(actual, expected)
+    print(f'rows: {args.rows}')
+    print(f'legacy: {legacy_seconds:.2f}s')
+    print(f'single pass: {seconds:.2f}s ({legacy_seconds / seconds:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
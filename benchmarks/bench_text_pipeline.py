@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Peak memory and latency of the sparse text classification pipeline against the previous dense one.
+
+    python benchmarks/bench_text_pipeline.py --labelled 2000 --unlabelled 20000
+
+Both pipelines are fitted on the labelled rows and then score the unlabelled rows with
+predict_proba, as in BaseTextClassifier.update_model and query_new_example.
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.pipeline import Pipeline, FeatureUnion, make_pipeline
+
+from NERD.TEXT import DefaultTextFeaturizer, ColumnsSelector, MultiLabelEncoder, ToDense, ToSparse
+
+WORDS = ['course', 'introduction', 'machine', 'learning', 'street', 'road', 'avenue', 'london', 'boston',
+         'professor', 'credits', 'fall', 'spring', 'data', 'algorithms', 'systems', 'flat', 'suite', 'house']
+
+
+def make_data(rows, seed=0):
+    rnd = random.Random(seed)
+    vocab = WORDS + [f'w{i}' for i in range(20000)]
+    texts, classes = [], []
+    for _ in range(rows):
+        is_address = rnd.random() < 0.5
+        words = [rnd.choice(vocab) for _ in range(rnd.randint(20, 40))]
+        if is_address:
+            words = [str(rnd.randint(1, 999))] + words + ['street']
+        texts.append(' '.join(words))
+        classes.append('Address' if is_address else 'Other')
+    data = pd.DataFrame(data={'text': texts, 'class': classes})
+    features = DefaultTextFeaturizer().transform(data['text'])
+    return pd.concat([data, features], axis=1), list(features.columns)
+
+
+def build(feature_columns, dense):
+    text_vectorizer = [ColumnsSelector('text'), CountVectorizer(ngram_range=(1, 2))]
+    text_featurizer = [ColumnsSelector(feature_columns), MultiLabelEncoder()]
+    if dense:
+        text_vectorizer.append(ToDense())
+    else:
+        text_featurizer.append(ToSparse())
+    return Pipeline([
+        ('fu', FeatureUnion([
+            ('text_vectorizer', make_pipeline(*text_vectorizer)),
+            ('text_featurizer', make_pipeline(*text_featurizer)),
+        ])),
+        ('clf', RandomForestClassifier(n_estimators=20, random_state=0))
+    ])
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--labelled', type=int, default=2000)
+    parser.add_argument('--unlabelled', type=int, default=20000)
+    args = parser.parse_args()
+
+    data, feature_columns = make_data(args.labelled + args.unlabelled)
+    lab, unlab = data.iloc[:args.labelled], data.iloc[args.labelled:]
+
+    for name, dense in (('dense', True), ('sparse', False)):
+        model = build(feature_columns, dense)
+        fit_seconds, fit_peak = measure(lambda: model.fit(lab, lab['class']))
+        predict_seconds, predict_peak = measure(lambda: model.predict_proba(unlab))
+        print(f'{name:>6}: fit {fit_seconds:.2f}s peak {fit_peak:.0f}MB | '
+              f'predict_proba {predict_seconds:.2f}s peak {predict_peak:.0f}MB')
+
+
+if __name__ == '__main__':
+    main()
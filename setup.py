@@ -16,10 +16,13 @@ setuptools.setup(
     package_data={
             "NERD": ["html_templates/*"],
         },
+    entry_points={
+            "console_scripts": ["nerd-annotate=NERD.cli:main"],
+        },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
\ No newline at end of file